@@ -3,8 +3,10 @@ from gevent import monkey
 monkey.patch_all()
 
 from wapiti import WapitiClient
+from wapiti.operations.executors import GeventExecutor
 
-client = WapitiClient('you@example.com')
+# the executor also parallelizes requests within each recursive crawl
+client = WapitiClient('you@example.com', executor=GeventExecutor(20))
 
 cats = ('Africa', 'FA-Class_articles', 'GA-Class_articles', 'Physics')
 tasks = [gevent.spawn(client.get_category_recursive, x, 1000) for x in cats]
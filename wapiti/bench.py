@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sys
+import time
+import subprocess
+from os.path import dirname, abspath
+from datetime import datetime, timedelta
+from argparse import ArgumentParser
+
+from operations.template_parser import (_ALL_TEST_STRS,
+                                        LEXICON,
+                                        Tokenizer,
+                                        tokenize,
+                                        parse,
+                                        get_page_templates,
+                                        iter_page_templates)
+from operations import models
+from operations.models import RevisionInfo
+
+DEFAULT_COUNT = 200
+MODELS_PER_COUNT = 500  # 100k models at the default count
+IMPORT_RUNS = 10
+IMPORT_REPORT_COUNT = 10
+
+_REV_DICT = {'title': 'Coffee', 'ns': 0, 'pageid': 604727,
+             'revid': 539916351, 'parentid': 539904117,
+             'user': 'Example', 'userid': 42, 'size': 73419,
+             'timestamp': '2013-02-21T21:54:25Z',
+             'comment': 'copyedit', 'tags': []}
+
+
+def timed(func, count):
+    start = time.time()
+    for _ in xrange(count):
+        func()
+    return (time.time() - start) / count
+
+
+def report(name, per_call, baseline=None, unit='page'):
+    line = '  %-28s %10.2f us/%s' % (name, per_call * 1e6, unit)
+    if baseline:
+        line += '  (%.1fx)' % (baseline / per_call)
+    print line
+
+
+def bench_tokenize(count):
+    pages = _ALL_TEST_STRS
+
+    def uncached():
+        # what tokenize() used to do: rebuild the scanner every page
+        for page in pages:
+            Tokenizer(LEXICON).tokenize(page)
+
+    def memoized():
+        for page in pages:
+            tokenize(page)
+
+    tokenizer = Tokenizer(LEXICON)
+
+    def prebuilt():
+        for page in pages:
+            tokenizer.tokenize(page)
+
+    baseline = timed(uncached, count) / len(pages)
+    report('rebuilt scanner', baseline)
+    report('memoized scanner', timed(memoized, count) / len(pages), baseline)
+    report('prebuilt Tokenizer', timed(prebuilt, count) / len(pages), baseline)
+
+
+def bench_parse(count):
+    pages = _ALL_TEST_STRS
+
+    def tokenize_and_parse():
+        for page in pages:
+            parse(tokenize(page))
+
+    def streaming():
+        for page in pages:
+            for tmpl in iter_page_templates(page):
+                pass
+
+    baseline = timed(tokenize_and_parse, count) / len(pages)
+    report('tokenize + parse', baseline)
+    report('iter_page_templates', timed(streaming, count) / len(pages),
+           baseline)
+
+
+def bench_named_templates(count):
+    pages = _ALL_TEST_STRS
+
+    def parse_and_filter():
+        for page in pages:
+            [t for t in get_page_templates(page) if t.name == 'cite web']
+
+    def named():
+        for page in pages:
+            get_page_templates(page, names=['cite web'])
+
+    baseline = timed(parse_and_filter, count) / len(pages)
+    report('parse all, then filter', baseline)
+    report('names=[...]', timed(named, count) / len(pages), baseline)
+
+
+def bench_models(count):
+    model_count = count * MODELS_PER_COUNT
+    rev_dict, kw = _REV_DICT, {'source': 'http://en.wikipedia.org/w/api.php'}
+
+    def init_from_query():
+        RevisionInfo._init_from_query(rev_dict, kw)
+
+    def from_query():
+        RevisionInfo.from_query(rev_dict, **kw)
+
+    for name, func in [('__init__() from_query', init_from_query),
+                       ('generated from_query', from_query)]:
+        per_call = timed(func, model_count)
+        print '  %-28s %10d models/sec' % (name, 1 / per_call)
+
+
+def bench_timestamps(count):
+    start = datetime(2013, 1, 1)
+    timestamps = [(start + timedelta(seconds=i * 37)).strftime(
+                  models.TIMESTAMP_FORMAT) for i in xrange(count * 50)]
+    fmt = models.TIMESTAMP_FORMAT
+
+    def strptime():
+        for ts in timestamps:
+            datetime.strptime(ts, fmt)
+
+    def fast():
+        models._TIMESTAMP_CACHE.clear()
+        for ts in timestamps:
+            models.parse_timestamp(ts)
+
+    def memoized():
+        for ts in timestamps[:100] * (len(timestamps) // 100):
+            models.parse_timestamp(ts)
+
+    def epoch():
+        for ts in timestamps:
+            models.parse_timestamp_epoch(ts)
+
+    baseline = timed(strptime, 1) / len(timestamps)
+    report('strptime', baseline, unit='timestamp')
+    for name, func in [('parse_timestamp', fast),
+                       ('parse_timestamp (repeats)', memoized),
+                       ('parse_timestamp_epoch', epoch)]:
+        report(name, timed(func, 1) / len(timestamps), baseline,
+               unit='timestamp')
+
+
+# Run in a fresh interpreter, like "python -X importtime", which Python
+# 2 lacks: times every import statement, nested imports included.
+_IMPORT_TIMER = """
+import sys, time, __builtin__
+_import = __builtin__.__import__
+times, depth = {}, [0]
+
+def timed_import(name, *a, **kw):
+    depth[0] += 1
+    start = time.time()
+    try:
+        return _import(name, *a, **kw)
+    finally:
+        depth[0] -= 1
+        key = (depth[0], name)
+        times[key] = times.get(key, 0) + time.time() - start
+
+__builtin__.__import__ = timed_import
+start = time.time()
+import wapiti
+total = time.time() - start
+__builtin__.__import__ = _import
+top = sorted(times.items(), key=lambda item: -item[1])[:%d]
+print total
+for (depth, name), duration in top:
+    print duration, depth, name
+"""
+
+
+def bench_import(count):
+    # count is ignored; every run is a new process
+    path = dirname(dirname(abspath(__file__)))
+    timer = _IMPORT_TIMER % IMPORT_REPORT_COUNT
+    runs = []
+    for _ in xrange(IMPORT_RUNS):
+        output = subprocess.check_output([sys.executable, '-c', timer],
+                                         cwd=path)
+        runs.append(output.splitlines())
+    best = min(runs, key=lambda lines: float(lines[0]))
+    print '  %-28s %10.2f ms (best of %d)' % ('import wapiti',
+                                             float(best[0]) * 1e3,
+                                             IMPORT_RUNS)
+    for line in best[1:]:
+        duration, depth, name = line.split()
+        name = '  ' * int(depth) + name
+        print '    %-26s %10.2f ms' % (name, float(duration) * 1e3)
+
+
+def create_parser():
+    parser = ArgumentParser(description='Microbenchmarks')
+    parser.add_argument('functions', nargs='*')
+    parser.add_argument('--count', '-c', type=int, default=DEFAULT_COUNT)
+    return parser
+
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    if args.functions:
+        benches = []
+        for func in args.functions:
+            try:
+                benches.append((func, globals()[func]))
+            except KeyError:
+                print func, 'is not a valid benchmark function'
+                continue
+    else:
+        benches = sorted([(k, v) for k, v in globals().items()
+                          if callable(v) and k.startswith('bench_')])
+    for name, bench in benches:
+        print name
+        bench(args.count)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,6 @@ but check back soon.
  * Retry and timeout behaviors
  * Get my shit together and continue work on the HTTP client.
  * Underscoring args
- * pause/resume
  * better differentiation between the following error groups:
    * Network/connectivity
    * Logic
@@ -32,8 +31,16 @@ Need generic support for:
  * Redirect following
 '''
 import re
+import threading
 
-from operations import ALL_OPERATIONS, DEFAULT_API_URL
+import operations
+from operations import OPERATION_NAMES, DEFAULT_API_URL
+# the same ransom module as the operations', not a second copy of it
+from operations.base import DEFAULT_HEADERS, ransom
+from operations.executors import DEFAULT_EXECUTOR
+from operations.dedupe import DEFAULT_KEY_STORE_TYPE
+from operations.stats import OperationStats
+from operations.retry import RetryPolicy
 
 DEFAULT_TIMEOUT = 15
 import socket
@@ -51,18 +58,34 @@ def under2camel(string):
     return ''.join(w.capitalize() or '_' for w in string.split('_'))
 
 
+_OP_ATTR_NAMES = {}  # e.g., 'get_category' -> 'GetCategory', filled lazily
+
+
+def get_op_attr_names():
+    if not _OP_ATTR_NAMES:
+        _OP_ATTR_NAMES.update([(camel2under(op_name), op_name)
+                               for op_name in OPERATION_NAMES])
+    return _OP_ATTR_NAMES
+
+
 class BoundOperation(object):  # TODO: Operation subtype?
     def __init__(self, op_type, client):
         self.client = client
         self.op_type = op_type
         self.op_inst = None
 
-    def __call__(self, *a, **kw):
+    def _get_op_inst(self, *a, **kw):
         if not self.op_inst:
             kw.setdefault('client', self.client)
             self.op_inst = self.op_type(*a, **kw)
             kw.pop('client')
-        return self.op_inst()
+        return self.op_inst
+
+    def __call__(self, *a, **kw):
+        return self._get_op_inst(*a, **kw)()
+
+    def iter_results(self, *a, **kw):
+        return self._get_op_inst(*a, **kw).iter_results()
 
     def __repr__(self):
         cn = self.__class__.__name__
@@ -98,8 +121,18 @@ class WapitiClient(object):
                  user_email,
                  api_url=None,
                  is_bot=False,
-                 init_source=True,
-                 debug=False):
+                 init_source=False,
+                 debug=False,
+                 web_client=None,
+                 executor=None,
+                 key_store_type=None,
+                 response_cache=None,
+                 metrics_hooks=None,
+                 rate_limiter=None,
+                 retry_policy=None,
+                 parse_pool=None,
+                 siteinfo_cache=None,
+                 maxlag=None):
         # set settings obj
         # set up source (from api_url in settings)
         # then you're ready to call ops
@@ -107,17 +140,94 @@ class WapitiClient(object):
         self.api_url = api_url or DEFAULT_API_URL
         self.is_bot = is_bot
         self.debug = debug
+        # one web client (connection pool and rate limiter) per
+        # WapitiClient, shared by all bound operations and their
+        # suboperations. limiting is opt-in, pass a ransom.RateLimiter
+        # (or True for one with the default rates).
+        if rate_limiter is True:
+            rate_limiter = ransom.RateLimiter()
+        if web_client is None:
+            web_client = ransom.Client({'headers': DEFAULT_HEADERS},
+                                       rate_limiter=rate_limiter or None)
+        self.web_client = web_client
+        # opt-in, e.g., 5 to have the API refuse requests while its
+        # replicas lag by more than 5 seconds, retrying after a wait
+        self.maxlag = maxlag
+        # e.g., ThreadExecutor(8) to run independent subops concurrently
+        self.executor = executor or DEFAULT_EXECUTOR
+        # see operations/dedupe.py for memory-saving alternatives
+        self.key_store_type = key_store_type or DEFAULT_KEY_STORE_TYPE
+        # opt-in, see operations/cache.py
+        self.response_cache = response_cache
+        # totals for all operations run by this client, and callables
+        # receiving per-request records (see operations/stats.py)
+        self.stats = OperationStats()
+        self.metrics_hooks = list(metrics_hooks or [])
+        # failure counts are shared, see operations/retry.py
+        self.retry_policy = retry_policy or RetryPolicy()
+        # e.g., template_parser.ParsePool() to parse on all cores
+        self.parse_pool = parse_pool
+        # source_info is fetched on first use. opt-in, pass a
+        # SiteInfoCache (or True for one in ~/.cache/wapiti) to share
+        # the fetch between clients, see operations/cache.py
+        if siteinfo_cache is True:
+            from operations.cache import SiteInfoCache
+            siteinfo_cache = SiteInfoCache()
+        self.siteinfo_cache = siteinfo_cache or None
+        self._source_info = None
+        self._source_info_lock = threading.Lock()
 
         if init_source:
             self._init_source()
 
     def _init_source(self):
+        return self.source_info
+
+    def _fetch_source_info(self):
         # TODO: no input_field and single respones
-        self.source_info = self.get_source_info()[0]
+        return self.get_source_info()[0]
+
+    @property
+    def source_info(self):
+        with self._source_info_lock:
+            if self._source_info is None:
+                if self.siteinfo_cache:
+                    cache = self.siteinfo_cache
+                    self._source_info = cache.get_or_fetch(
+                        self.api_url, self._fetch_source_info)
+                else:
+                    self._source_info = self._fetch_source_info()
+        return self._source_info
+
+    def __getattr__(self, name):
+        # only called for missing attributes. operations are imported,
+        # and bound to the class, on first use (see operations/__init__)
+        try:
+            op_name = get_op_attr_names()[name]
+        except KeyError:
+            raise AttributeError('%r object has no attribute %r'
+                                 % (self.__class__.__name__, name))
+        unbound_op = UnboundOperation(getattr(operations, op_name))
+        setattr(WapitiClient, name, unbound_op)
+        return unbound_op.__get__(self, type(self))
+
+    def __dir__(self):
+        ret = set(dir(type(self))) | set(self.__dict__)
+        return sorted(ret | set(get_op_attr_names()))
+
+    @property
+    def op_map(self):
+        return dict([(op.__name__, op) for op in operations.ALL_OPERATIONS])
+
+    @property
+    def unbound_op_map(self):
+        return dict([(attr_name, UnboundOperation(getattr(operations,
+                                                          op_name)))
+                     for attr_name, op_name in get_op_attr_names().items()])
 
     @property
     def op_names(self):
-        return list(sorted(self.op_map.keys()))
+        return list(sorted(OPERATION_NAMES))
 
     def print_usage(self, query=None):
         op_names = self.op_names
@@ -126,8 +236,3 @@ class WapitiClient(object):
         print '\n'.join(self.op_map[name].help_str for name in op_names)
 
     # TODO: configurable operations
-    op_map = dict([(op.__name__, op) for op in ALL_OPERATIONS])
-    unbound_op_map = dict([(camel2under(op_name), UnboundOperation(op))
-                           for op_name, op in op_map.items()])
-    unbound_op_set = set(unbound_op_map.values())
-    locals().update(unbound_op_map)
@@ -1,23 +1,125 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import sys
+from types import ModuleType
+from importlib import import_module
+from collections import OrderedDict
+
 from base import WapitiException, DEFAULT_API_URL, OperationMeta
 from models import PageIdentifier, CategoryInfo, RevisionInfo
 
-import category
-import feedback
-import files
-import links
-import meta
-import misc
-import protection
-import rand
-import revisions
-import templates
-import user
-import query_operations
-
-for op in OperationMeta._all_ops:
-    globals()[op.__name__] = op
-
-ALL_OPERATIONS = tuple(OperationMeta._all_ops)
+# Operation modules are only imported once one of their operations is
+# used (e.g., ``operations.GetCategory``), or all of them are listed
+# with ``ALL_OPERATIONS``. Keep this in sync when adding operations;
+# test_basic.test_operation_registry checks it.
+OPERATION_MODULES = OrderedDict([
+    ('base', ['MediaWikiCall', 'WebRequestOperation', 'GetPageHTML']),
+    ('category', ['GetCategoryList',
+                  'GetCategory',
+                  'GetCategoryArticles',
+                  'GetSubcategoryInfos',
+                  'GetAllCategoryInfos',
+                  'GetFlattenedCategory',
+                  'GetCategoryRecursive',
+                  'GetCategoryArticlesRecursive']),
+    ('revisions', ['GetPageRevisionInfos',
+                   'GetRevisionInfos',
+                   'GetCurrentContent',
+                   'GetRevisionContent',
+                   'GetCurrentTalkContent']),
+    ('templates', ['GetTemplates',
+                   'GetTranscludes',
+                   'GetParsedTemplates',
+                   'GetParsedTemplatesPage',
+                   'GetParsedTranscludes']),
+    ('dump', ['GetDumpRevisions', 'GetDumpParsedTemplates']),
+    ('batch', ['BatchQuery']),
+    ('feedback', ['GetFeedbackV5']),
+    ('files', ['GetImages', 'GetImageInfos', 'GetAllImageInfos']),
+    ('links', ['GetBacklinks',
+               'GetLinks',
+               'GetExternalLinks',
+               'GetLanguageLinks',
+               'GetInterwikiLinks']),
+    ('meta', ['GetSourceInfo']),
+    ('misc', ['GetPageInfo',
+              'GetCoordinates',
+              'GeoSearch',
+              'GetRecentChanges']),
+    ('protection', ['GetProtections']),
+    ('rand', ['GetRandom',
+              'GetRandomArticles',
+              'GetRandomCategories',
+              'GetRandomFilePages']),
+    ('user', ['GetUserContribs']),
+    ('query_operations', ['GetQueryPage',
+                          'GetAncientPages',
+                          'GetBrokenRedirects',
+                          'GetDeadendPages',
+                          'GetDisambiguations',
+                          'GetDoubleRedirects',
+                          'GetListRedirects',
+                          'GetLonelyPages',
+                          'GetLongPages',
+                          'GetMostCategories',
+                          'GetMostImages',
+                          'GetMostInterwikiLinks',
+                          'GetMostLinkedCategories',
+                          'GetMostLinkedTemplates',
+                          'GetMostLinked',
+                          'GetMostRevisions',
+                          'GetFewestRevisions',
+                          'GetShortPages',
+                          'GetUncategorizedCategories',
+                          'GetUncategorizedPages',
+                          'GetUncategorizedImages',
+                          'GetUncategorizedTemplates',
+                          'GetUnusedCategories',
+                          'GetUnusedImages',
+                          'GetWantedCategories',
+                          'GetWantedFiles',
+                          'GetWantedPages',
+                          'GetWantedTemplates',
+                          'GetUnusedTemplates',
+                          'GetWithoutInterwikiLinks'])])
+
+OPERATION_NAMES = tuple([op_name for op_names in OPERATION_MODULES.values()
+                         for op_name in op_names])
+_OP_MODULE_MAP = dict([(op_name, mod_name)
+                       for mod_name, op_names in OPERATION_MODULES.items()
+                       for op_name in op_names])
+
+
+class LazyOperationsModule(ModuleType):
+    """
+    Stands in for this package's module, importing operation modules
+    on first access to their operations.
+    """
+    def _import(self, mod_name):
+        return import_module('.' + mod_name, self.__name__)
+
+    def __getattr__(self, name):
+        if name == 'ALL_OPERATIONS':
+            for mod_name in OPERATION_MODULES:
+                self._import(mod_name)
+            ret = tuple(OperationMeta._all_ops)
+        elif name in _OP_MODULE_MAP:
+            ret = getattr(self._import(_OP_MODULE_MAP[name]), name)
+        elif name in OPERATION_MODULES:
+            ret = self._import(name)
+        else:
+            raise AttributeError('%r module has no attribute %r'
+                                 % (self.__name__, name))
+        setattr(self, name, ret)
+        return ret
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(OPERATION_NAMES)
+                      | set(['ALL_OPERATIONS']))
+
+
+_module = LazyOperationsModule(__name__, __doc__)
+_module.__dict__.update(globals())
+_module._original_module = sys.modules[__name__]  # keeps globals alive
+sys.modules[__name__] = _module
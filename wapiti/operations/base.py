@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import os
+import gzip
 import json
+import time
+import cPickle as pickle
 from abc import ABCMeta
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from functools import wraps
 
 import sys
@@ -15,6 +19,10 @@ import ransom
 
 from params import SingleParam, StaticParam
 from models import get_unique_func, get_priority_func
+from executors import DEFAULT_EXECUTOR
+from dedupe import DEFAULT_KEY_STORE_TYPE
+from stats import OperationStats, emit_metrics
+from retry import RetryPolicy, is_timeout
 from utils import (PriorityQueue,
                    MaxInt,
                    chunked_iter,
@@ -23,7 +31,6 @@ from utils import (PriorityQueue,
 
 # TODO: handle automatic redirecting better
 # TODO: support batching and optimization limits
-# TODO: concurrency. get_current_task() -> get_current_tasks()
 # TODO: wrap exceptions
 # TODO: separate structure for saving completed subops (for debugging?)
 # TODO: WebRequestOperation: accepts URL, action (default: GET)
@@ -95,6 +102,14 @@ class MockClient(object):
     def __init__(self, is_bot=False, **kwargs):
         self.debug = kwargs.pop('debug', False)
         self.web_client = DEFAULT_WEB_CLIENT
+        self.executor = DEFAULT_EXECUTOR
+        self.key_store_type = DEFAULT_KEY_STORE_TYPE
+        self.response_cache = None
+        self.stats = OperationStats()
+        self.metrics_hooks = []
+        self.retry_policy = RetryPolicy()
+        self.parse_pool = None
+        self.maxlag = None
         self.api_url = DEFAULT_API_URL
         self.is_bot = is_bot
 
@@ -196,13 +211,32 @@ def operation_signature_doc(operation):
     return doc_template % (doc_input, doc_output)
 
 
+class OperationDoc(object):
+    """
+    The ``__doc__`` of an operation type: its docstring, followed by
+    its signature (see operation_signature_doc()). The signature is
+    generated on first access, not at import time.
+    """
+    def __init__(self, doc):
+        self.doc = doc
+        self.full_doc = None
+
+    def __get__(self, obj, obj_type=None):
+        if self.full_doc is None:
+            doc = (self.doc and self.doc + '\n') or ''
+            self.full_doc = doc + operation_signature_doc(obj_type)
+        return self.full_doc
+
+
 class OperationMeta(ABCMeta):
     _all_ops = []
 
     def __new__(cls, name, bases, attrs):
+        if name in ('Operation', 'QueryOperation', 'FusedQueryOperation'):
+            # TODO: add elegance?
+            return super(OperationMeta, cls).__new__(cls, name, bases, attrs)
+        attrs['__doc__'] = OperationDoc(attrs.get('__doc__'))
         ret = super(OperationMeta, cls).__new__(cls, name, bases, attrs)
-        if name == 'Operation' or name == 'QueryOperation':
-            return ret  # TODO: add elegance?
         subop_chain = getattr(ret, 'subop_chain', [])
         try:
             input_field = ret.input_field
@@ -238,9 +272,9 @@ class OperationMeta(ABCMeta):
         for ex in getattr(ret, 'examples', []):
             ex.bind_op_type(ret)
 
-        ret.__doc__ = (ret.__doc__ and ret.__doc__ + '\n') or ''
-        ret.__doc__ += operation_signature_doc(ret)
-        cls._all_ops.append(ret)
+        ret.fused_chain = plan_subop_chain(ret)
+        if not issubclass(ret, FusedQueryOperation):
+            cls._all_ops.append(ret)
         return ret
 
     @property
@@ -256,7 +290,8 @@ class OperationQueue(object):
     # TODO: chunking/batching should probably happen here
     # with the assistance of another queue for prioritized params
     # (i.e., don't create subops so eagerly)
-    def __init__(self, qid, op_type, default_limit=ALL):
+    def __init__(self, qid, op_type, default_limit=ALL,
+                 key_store_type=None, track_dups=False):
         self.qid = qid
         options, unwrapped = get_unwrapped_options(op_type)
         self.op_type = op_type
@@ -268,18 +303,24 @@ class OperationQueue(object):
         self.priority = options.get('priority', 0)
         self.priority_func = get_priority_func(self.priority)
         self.default_limit = default_limit
+        self.subop_kwargs = {}  # extra keyword arguments for new subops
 
-        self.param_set = set()
+        key_store_type = key_store_type or DEFAULT_KEY_STORE_TYPE
+        self.param_set = key_store_type()
         self.op_queue = PriorityQueue()
-        self._dup_params = []
+        self.dup_count = 0
+        self._dup_params = [] if track_dups else None
 
     def enqueue(self, param, **kw):
         unique_key = self.unique_func(param)
         if unique_key in self.param_set:
-            self._dup_params.append(unique_key)
+            self.dup_count += 1
+            if self._dup_params is not None:
+                self._dup_params.append(unique_key)
             return
         priority = self.priority_func(param)
         kwargs = {'limit': self.default_limit}
+        kwargs.update(self.subop_kwargs)
         kwargs.update(kw)
         new_subop = self.op_type(param, **kwargs)
         new_subop._origin_queue = self.qid
@@ -297,9 +338,54 @@ class OperationQueue(object):
     def peek(self, *a, **kw):
         return self.op_queue.peek(*a, **kw)
 
+    def peek_many(self, *a, **kw):
+        return self.op_queue.peek_many(*a, **kw)
+
     def pop(self, *a, **kw):
         return self.op_queue.pop(*a, **kw)
 
+    def remove(self, *a, **kw):
+        return self.op_queue.remove(*a, **kw)
+
+    def get_state(self):
+        subops = [(subop._get_state(), priority)
+                  for subop, priority in self.op_queue.items()]
+        return {'param_set': self.param_set,
+                'dup_count': self.dup_count,
+                'subops': subops}
+
+    def set_state(self, state, client):
+        self.param_set = state['param_set']
+        self.dup_count = state['dup_count']
+        self.op_queue = PriorityQueue()
+        for subop_state, priority in state['subops']:
+            subop = op_from_state(subop_state, client)
+            subop._origin_queue = self.qid
+            self.op_queue.add(subop, priority)
+
+
+CHECKPOINT_VERSION = 1
+DEFAULT_CHECKPOINT_INTERVAL = 300  # seconds
+
+
+def op_from_state(state, client=None):
+    """
+    Creates an operation from the output of its _get_state(), as
+    saved by Operation.checkpoint().
+    """
+    op_type, limit = state['type'], state['limit']
+    if limit == 'ALL':
+        limit = ALL
+    kwargs = dict(state['kwargs'])
+    kwargs['client'] = client
+    if op_type.input_field is None:
+        op = op_type(limit, **kwargs)
+    else:
+        op = op_type(state['input_param'], limit, **kwargs)
+    if 'queues' in state:
+        op._set_state(state)
+    return op
+
 
 class Operation(object):
     """
@@ -308,7 +394,9 @@ class Operation(object):
     """
     __metaclass__ = OperationMeta
 
-    subop_chain = []
+    subop_chain = []     # fused into fewer queries, see plan_subop_chain()
+    keep_results = True  # False once streaming, see iter_results()
+    table_type = None    # a ResultTable type, if columnar=True is supported
 
     def __init__(self, input_param, limit=None, **kw):
         self.client = kw.pop('client', None)
@@ -316,21 +404,41 @@ class Operation(object):
             self.client = DEFAULT_CLIENT
         self.api_url = self.client.api_url
         self.is_bot_op = self.client.is_bot
+        self.executor = getattr(self.client, 'executor', None)
+        if self.executor is None:
+            self.executor = DEFAULT_EXECUTOR
+        self.key_store_type = getattr(self.client, 'key_store_type', None)
+        if self.key_store_type is None:
+            self.key_store_type = DEFAULT_KEY_STORE_TYPE
 
         self.set_input_param(input_param)
         self.set_limit(limit)
 
         self.kwargs = kw
         self.started = False
-        self.results = OrderedDict()
-
-        subop_queues = [OperationQueue(0, type(self))]
-        if self.subop_chain:
-            subop_queues.extend([OperationQueue(i + 1, st) for i, st
-                                 in enumerate(self.subop_chain)])
-            subop_queues[1].enqueue_many(self.input_param_list,
-                                         client=self.client)
+        self.columnar = bool(kw.get('columnar'))
+        if self.columnar:
+            if self.table_type is None:
+                raise ValueError('%s does not support columnar results'
+                                 % self.__class__.__name__)
+            self.results = self.table_type(source=self.source)
+        else:
+            self.results = OrderedDict()
+        # reparented to the owning operation's stats, if any, in process()
+        self.stats = OperationStats(parent=getattr(self.client, 'stats', None))
+
+        subop_chain = self.subop_chain
+        if kw.get('fuse', True):
+            subop_chain = self.fused_chain
+        ks_type = self.key_store_type
+        subop_queues = [OperationQueue(0, type(self), key_store_type=ks_type)]
+        if subop_chain:
+            subop_queues.extend([OperationQueue(i + 1, st,
+                                                key_store_type=ks_type)
+                                 for i, st in enumerate(subop_chain)])
         self.subop_queues = subop_queues
+        if subop_chain:
+            self._enqueue(subop_queues[1], self.input_param_list)
 
     def get_progress(self):
         return len(self.results)
@@ -384,35 +492,121 @@ class Operation(object):
         return max(0, limit - len(self.results))
 
     def process(self):
-        self.started = True
-        task = self.get_current_task()
+        self._mark_started()
+        tasks = self.get_current_tasks(self.executor.max_workers)
         if self.client.debug:
-            print self.__class__.__name__, self.remaining
-        if task is None:
+            print self.__class__.__name__, self.remaining, len(tasks)
+        if not tasks:
             raise NoMoreResults()
-        elif isinstance(task, Operation):
-            results = task.process()
-        elif callable(task):  # not actually used
-            results = task()
-        else:
-            msg = 'task expected as Operation or callable, not: %r' % task
-            raise TypeError(msg)
+        for task in tasks:
+            self._adopt_task(task)
+        task_results = self.executor.map(self._process_task, tasks)
         # TODO: check resp for api errors/warnings
         # TODO: check for unrecognized parameter values
-        new_results = self.store_results(task, results)
+        new_results = []
+        for task, results in zip(tasks, task_results):
+            if results is None:
+                self._retire_task(task)
+                continue
+            new_results.extend(self.store_results(task, results))
         return new_results
 
+    def _mark_started(self):
+        if not self.started:
+            self.started = True
+            self.stats.add(ops_executed=1)
+
+    def _adopt_task(self, task):
+        # roll the task's stats up into this operation's
+        task_stats = getattr(task, 'stats', None)
+        if task_stats is not None:
+            task_stats.parent = self.stats
+
+    def _enqueue(self, queue, params):
+        dup_count = queue.dup_count
+        queue.enqueue_many(params, client=self.client)
+        if queue.dup_count > dup_count:
+            self.stats.add(subops_skipped=queue.dup_count - dup_count)
+
+    def _emit_metrics(self):
+        record = {'type': 'operation',
+                  'operation': self.__class__.__name__,
+                  'input': self.input_param,
+                  'result_count': len(self.results)}
+        record.update(self.stats.to_dict())
+        emit_metrics(self.client, record)
+
+    def _record_request(self, resp, **extra):
+        """
+        Records a web request made by this operation, ``resp`` being
+        a ransom.Response, or None if the request failed.
+        """
+        if resp is None:
+            self.stats.add(requests=1, errors=1)
+            record = {}
+        else:
+            self.stats.add(requests=1,
+                           retries=resp.retries,
+                           raw_bytes=resp.raw_size,
+                           bytes=resp.size,
+                           request_time=resp.elapsed or 0.0)
+            record = {'status': resp.status_code,
+                      'elapsed': resp.elapsed,
+                      'raw_size': resp.raw_size,
+                      'size': resp.size,
+                      'retries': resp.retries}
+        record.update(extra)
+        record['type'] = 'request'
+        record['url'] = self.url
+        emit_metrics(self.client, record)
+
+    def _process_task(self, task):
+        # may run outside of the calling thread; no touching self here
+        if isinstance(task, Operation):
+            try:
+                return task.process()
+            except NoMoreResults:
+                return None
+        elif callable(task):  # not actually used
+            return task()
+        msg = 'task expected as Operation or callable, not: %r' % task
+        raise TypeError(msg)
+
+    def _retire_task(self, task):
+        oqi = getattr(task, '_origin_queue', None)
+        if oqi is None:
+            return
+        try:
+            self.subop_queues[oqi].remove(task)
+        except KeyError:
+            pass
+
     def get_current_task(self):
-        if not self.remaining:
+        tasks = self.get_current_tasks(1)
+        if not tasks:
             return None
+        return tasks[0]
+
+    def get_current_tasks(self, count=1):
+        """
+        Returns up to ``count`` distinct ready tasks, in priority
+        order. Deeper subop queues come first, as their results are
+        closer to being final results, and shallower queues fill any
+        leftover capacity.
+        """
+        if not self.remaining:
+            return []
+        ret = []
         for subop_queue in reversed(self.subop_queues):
-            while subop_queue:
-                subop = subop_queue.peek()
-                if subop.remaining:
-                    return subop
-                else:
-                    subop_queue.pop()
-        return None
+            while len(ret) < count and subop_queue:
+                subops = subop_queue.peek_many(count - len(ret))
+                spent = [subop for subop in subops if not subop.remaining]
+                if not spent:
+                    ret.extend(subops)
+                    break
+                for subop in spent:
+                    subop_queue.remove(subop)
+        return ret
 
     def store_results(self, task, results):
         new_res = []
@@ -424,15 +618,16 @@ class Operation(object):
         origin_queue = self.subop_queues[oqi]
         is_recursive = origin_queue.options.get('is_recursive')
         if is_recursive:
-            origin_queue.enqueue_many(results, client=self.client)
+            self._enqueue(origin_queue, results)
         if dqi < len(self.subop_queues):
-            dest_queue = self.subop_queues[dqi]
-            dest_queue.enqueue_many(results, client=self.client)
+            self._enqueue(self.subop_queues[dqi], results)
         else:
             new_res = self._update_results(results)
         return new_res
 
     def _update_results(self, results):
+        if self.columnar:
+            return self._update_table(results)
         ret = []
         filt_exists = self.kwargs.get('exists')
         filt_exists = filt_exists if filt_exists is None else bool(filt_exists)
@@ -444,18 +639,140 @@ class Operation(object):
             unique_key = getattr(res, 'unique_key', res)
             if unique_key in self.results:
                 continue
-            self.results[unique_key] = res
+            if self.keep_results:
+                self.results[unique_key] = res
+            else:
+                self.results.add(unique_key)
             ret.append(res)
         return ret
 
-    def process_all(self):
-        while 1:  # TODO: +retry behavior
+    def _update_table(self, table):
+        # no deduplication, see table.py
+        if len(table) > self.remaining:
+            table.truncate(self.remaining)
+        self.results.extend(table)
+        return table
+
+    def process_all(self, checkpoint_path=None,
+                    checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """
+        Processes the operation to completion and returns the results.
+        With a ``checkpoint_path``, progress is saved there every
+        ``checkpoint_interval`` seconds, and once more when done.
+        """
+        if not self.keep_results:
+            return list(self.iter_results(checkpoint_path,
+                                          checkpoint_interval))
+        last_saved = time.time()
+        while 1:  # retries happen per MediaWikiCall, see retry.py
             try:
                 self.process()
             except NoMoreResults:
                 break
+            if checkpoint_path and \
+                    time.time() - last_saved >= checkpoint_interval:
+                self.checkpoint(checkpoint_path)
+                last_saved = time.time()
+        if checkpoint_path:
+            self.checkpoint(checkpoint_path)
+        self._emit_metrics()
+        if self.columnar:
+            return self.results
         return self.results.values()
 
+    def iter_results(self, checkpoint_path=None,
+                     checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """
+        Like process_all(), but lazily yields each new result as soon
+        as process() produces it. From the first call on, the
+        operation only remembers the unique keys of its results (for
+        deduplication and limits), not the results themselves, so
+        memory use stays flat no matter how many results stream by.
+        The keys go in a store made by the client's key_store_type.
+
+        Checkpoints are saved between batches, once the results
+        produced so far have all been yielded, so a resumed operation
+        yields every result at least once. Results of the batch that
+        was interrupted may be yielded twice.
+
+        Columnar operations yield rows (see table.py), and keep their
+        compact ResultTable of all results.
+        """
+        if self.keep_results and not self.columnar:
+            self.keep_results = False
+            result_keys = self.key_store_type()
+            for unique_key in self.results:
+                result_keys.add(unique_key)
+            self.results = result_keys
+        last_saved = time.time()
+        while 1:
+            try:
+                new_results = self.process()
+            except NoMoreResults:
+                break
+            for res in new_results:
+                yield res
+            if checkpoint_path and \
+                    time.time() - last_saved >= checkpoint_interval:
+                self.checkpoint(checkpoint_path)
+                last_saved = time.time()
+        if checkpoint_path:
+            self.checkpoint(checkpoint_path)
+        self._emit_metrics()
+
+    def checkpoint(self, path):
+        """
+        Saves the progress of the operation and its suboperations
+        (queued subops, continuation strings, dedupe key stores, and
+        results, or result keys if streaming) to ``path``, as a
+        gzipped pickle. The file is replaced atomically, so an
+        interruption mid-save leaves the previous checkpoint intact.
+        """
+        state = {'version': CHECKPOINT_VERSION, 'op': self._get_state()}
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def resume(cls, path, client=None):
+        """
+        Recreates an operation from a checkpoint file, bound to
+        ``client``, ready to pick up where it left off.
+        """
+        with gzip.open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise ValueError('unsupported checkpoint version: %r'
+                             % state.get('version'))
+        op_type = state['op']['type']
+        if not issubclass(op_type, cls):
+            raise TypeError('expected checkpoint of %s, not %s'
+                            % (cls.__name__, op_type.__name__))
+        return op_from_state(state['op'], client)
+
+    def _get_init_state(self):
+        limit = self._orig_limit
+        return {'type': type(self),
+                'input_param': self._orig_input_param,
+                'limit': 'ALL' if limit is ALL else limit,
+                'kwargs': self.kwargs}
+
+    def _get_state(self):
+        ret = self._get_init_state()
+        ret['started'] = self.started
+        ret['keep_results'] = self.keep_results
+        ret['results'] = self.results
+        ret['queues'] = [q.get_state() for q in self.subop_queues]
+        return ret
+
+    def _set_state(self, state):
+        self.started = state['started']
+        self.keep_results = state['keep_results']
+        self.results = state['results']
+        for queue, queue_state in zip(self.subop_queues, state['queues']):
+            queue.set_state(queue_state, self.client)
+
     __call__ = process_all
 
     def __repr__(self):
@@ -473,15 +790,19 @@ class Operation(object):
 class QueryOperation(Operation):
     api_action = 'query'
     field_prefix = None        # e.g., 'gcm'
-    cont_str_key = None
     per_query_limit = DEFAULT_QUERY_LIMIT
     default_limit = ALL
+    multiplex_window = None    # max chunks in flight, default: max_workers
+    result_keys = ()           # of a prop op's data in pages, see is_fusable()
+    prefetch = True            # with a concurrent executor, see process()
 
     def __init__(self, input_param, limit=None, **kw):
         if limit is None:
             limit = self.default_limit
         super(QueryOperation, self).__init__(input_param, limit, **kw)
         self.cont_strs = []
+        self.prefetch = kw.get('prefetch', self.prefetch)
+        self._prefetched = None  # (MediaWikiCall, Job) for the next page
         self._set_params()
 
         if self.is_bijective and self.input_param and \
@@ -494,11 +815,7 @@ class QueryOperation(Operation):
     def _set_params(self):
         is_bot_op = self.is_bot_op
 
-        params = {}
-        for field in self.fields:
-            pref_key = field.get_key(self.field_prefix)
-            kw_val = self.kwargs.get(field.key)
-            params[pref_key] = field.get_value(kw_val)
+        params = get_field_params(self.fields, self.field_prefix, self.kwargs)
         if self.input_field:
             qp_key_pref = self.input_field.get_key(self.field_prefix)
             qp_val = self.input_field.get_value(self.input_param)
@@ -521,11 +838,110 @@ class QueryOperation(Operation):
 
     def _setup_multiplexing(self):
         subop_queue = self.subop_queues[0]
+        if self.columnar:
+            subop_queue.subop_kwargs['columnar'] = True
         chunk_size = self.per_query_param_limit
         for chunk in chunked_iter(self.input_param_list, chunk_size):
             subop_queue.enqueue(tuple(chunk), client=self.client)  # TODO
+        self._mux_inflight = deque()
         return
 
+    def process(self):
+        if self.is_multiplexing:
+            return self._process_multiplexed()
+        if self.prefetch and self.executor.is_concurrent:
+            return self._process_pipelined()
+        return super(QueryOperation, self).process()
+
+    def _process_pipelined(self):
+        """
+        Continuations make each request wait on the one before it, but
+        only on its continuation string, not its results. So as soon
+        as a response arrives, the request for the next page is sent
+        in the background, and downloads while this page's results
+        are extracted. Pass ``prefetch=False`` to turn this off.
+        """
+        self._mark_started()
+        if self._prefetched is not None:
+            task, job = self._prefetched
+            self._prefetched = None
+        else:
+            task = self.get_current_task()
+            if task is None:
+                raise NoMoreResults()
+            self._adopt_task(task)
+            job = self.executor.submit(self._process_task, task)
+        resp = job.get()
+        if resp is None:
+            raise NoMoreResults()
+        self._prefetch_next(resp)
+        return self.store_results(task, resp)
+
+    def _prefetch_next(self, resp):
+        next_cont_str = self.get_cont_str(resp)
+        if next_cont_str is None:
+            return
+        requested = resp.params.get(resp.limit_key) if resp.limit_key else 0
+        if self.remaining <= requested:
+            return  # this page might be the last one needed
+        # not the last response's continuation, which might include
+        # keys of modules that have finished since (e.g., rvcontinue)
+        params = self.prepare_params(cont_str=next_cont_str, **self.kwargs)
+        mw_call = MediaWikiCall(params, client=self.client,
+                                limit_key=resp.limit_key)
+        self._adopt_task(mw_call)
+        job = self.executor.submit(self._process_task, mw_call)
+        self._prefetched = (mw_call, job)
+
+    def _process_multiplexed(self):
+        """
+        Chunks of a multiplexed operation share no continuation state,
+        so up to ``multiplex_window`` of them are kept in flight at
+        once. Each call stores the results of the oldest chunk, which
+        keeps results in input (chunk) order regardless of which
+        requests come back first.
+        """
+        self._mark_started()
+        if not self.remaining:
+            raise NoMoreResults()
+        window = self.multiplex_window or self.executor.max_workers
+        subop_queue, inflight = self.subop_queues[0], self._mux_inflight
+        while subop_queue and len(inflight) < window:
+            subop = subop_queue.pop()
+            self._adopt_task(subop)
+            job = self.executor.submit(self._process_chunk, subop)
+            inflight.append((subop, job))
+        if not inflight:
+            raise NoMoreResults()
+        subop, job = inflight.popleft()
+        return self.store_results(subop, job.get())
+
+    def _process_chunk(self, subop):
+        return subop.process_all()
+
+    def _get_state(self):
+        ret = super(QueryOperation, self)._get_state()
+        ret['cont_strs'] = list(self.cont_strs)
+        ret['per_query_limit'] = self.per_query_limit
+        if self.is_multiplexing and self._mux_inflight:
+            # in-flight chunks may still be running, and none of their
+            # results have been stored yet, so they start over on resume
+            fresh_chunks = [(subop._get_init_state(), 0)
+                            for subop, _ in self._mux_inflight]
+            ret['queues'][0]['subops'][:0] = fresh_chunks
+        return ret
+
+    def _set_state(self, state):
+        super(QueryOperation, self)._set_state(state)
+        cont_str_key = state.get('cont_str_key')
+        if cont_str_key:
+            # saved before continuations were dicts of parameters
+            self.cont_strs = [{cont_str_key: cs} if cs is not None else None
+                              for cs in state['cont_strs']]
+        else:
+            self.cont_strs = list(state['cont_strs'])
+        self.per_query_limit = state['per_query_limit']
+
     @property
     def current_limit(self):
         ret = self.remaining
@@ -560,21 +976,39 @@ class QueryOperation(Operation):
             ret[query_key] = cls.input_field
         return ret
 
+    def get_current_tasks(self, count=1):
+        # continuations make a QueryOperation's own calls sequential,
+        # and multiplexed chunks go through _process_multiplexed()
+        task = self.get_current_task()
+        if task is None:
+            return []
+        return [task]
+
     def get_current_task(self):
-        if self.is_multiplexing:
-            return super(QueryOperation, self).get_current_task()
         if not self.remaining:
             return None
         params = self.prepare_params(**self.kwargs)
-        mw_call = MediaWikiCall(params, client=self.client)
+        limit_key = None
+        if not self.is_bijective:
+            limit_key = self.field_prefix + 'limit'
+        mw_call = MediaWikiCall(params, client=self.client,
+                                limit_key=limit_key)
         return mw_call
 
-    def prepare_params(self, **kw):
+    def prepare_params(self, cont_str=None, **kw):
+        """
+        Returns the parameters of the next request, continuing from
+        ``cont_str`` if given, else from the last response.
+        """
+        if cont_str is None:
+            cont_str = self.last_cont_str
         params = dict(self.params)
         if not self.is_bijective:
             params[self.field_prefix + 'limit'] = self.current_limit
-        if self.last_cont_str:
-            params[self.cont_str_key] = self.last_cont_str
+        if cont_str:
+            params.update(cont_str)
+        elif not self.cont_strs and self.api_action == 'query':
+            params['continue'] = ''  # asks for unified continuation
         params['action'] = self.api_action
         return params
 
@@ -589,7 +1023,33 @@ class QueryOperation(Operation):
         raise NotImplementedError('inheriting classes should return'
                                   ' a list of results from the response')
 
+    def iter_result_dicts(self, resp):
+        """
+        For operations with a ``table_type``, yields a pair for each
+        result in the response: the result's dictionary, and another
+        dictionary to fall back on for missing keys (or None).
+        """
+        raise NotImplementedError('inheriting classes with a table_type'
+                                  ' should yield (dict, defaults) pairs')
+
+    def extract_table(self, resp):
+        table = self.table_type(source=self.source)
+        for q_dict, defaults in self.iter_result_dicts(resp):
+            table.add_query(q_dict, defaults)
+        return table
+
     def get_cont_str(self, resp):
+        """
+        Returns the parameters which continue the query after
+        ``resp``, as a dict, or None once there's nothing left. On
+        MediaWiki 1.21+, these come from the unified ``continue``,
+        which covers every module of the query at once (e.g., a
+        generator and the props of its pages). Older wikis send the
+        legacy ``query-continue``, of which only the part for the
+        generator (or else prop, or list) module is followed.
+        """
+        if 'continue' in resp.results:
+            return dict(resp.results['continue'])
         qc_val = resp.results.get(self.api_action + '-continue')
         if qc_val is None:
             return None
@@ -599,9 +1059,7 @@ class QueryOperation(Operation):
                 break
         else:
             raise KeyError("couldn't find contstr")
-        if not self.cont_str_key:
-            self.cont_str_key = qc_val[next_key].keys()[0]
-        return qc_val[next_key][self.cont_str_key]
+        return qc_val.get(next_key)  # None if only other modules continue
 
     def store_results(self, task, resp):
         if self.is_multiplexing:
@@ -610,24 +1068,266 @@ class QueryOperation(Operation):
             self._notices = list(resp.notices)
             self._url = resp.url
             print "may have an error: %r (%r)" % (resp.notices, resp.url)
+        if resp.limit_key and resp.retry_count:
+            # the call may have asked for less after timing out
+            self.per_query_limit = min(self.per_query_limit,
+                                       resp.params[resp.limit_key])
+        start_time = time.time()
         processed_resp = self.post_process_response(resp)
         if processed_resp is None:
             new_cont_str = self.get_cont_str(resp)  # TODO: DRY this.
             self.cont_strs.append(new_cont_str)
             return []  # TODO: keep an eye on this
-        try:
+        if self.columnar:
+            new_results = self.extract_table(processed_resp)
+        else:
             new_results = self.extract_results(processed_resp)
-        except Exception:
-            raise
+        self.stats.add(extract_time=time.time() - start_time)
         super(QueryOperation, self).store_results(task, new_results)
         new_cont_str = self.get_cont_str(resp)
         self.cont_strs.append(new_cont_str)
         return new_results
 
 
+class FusedQueryOperation(QueryOperation):
+    """
+    A generator query, and a prop query for the pages it generates,
+    sent together as one query (e.g., ``generator=embeddedin`` with
+    ``prop=revisions``), instead of one query for the pages and
+    another per batch of them. Subclasses are made by
+    fuse_query_types(), to stand in for both steps of a subop chain
+    (see plan_subop_chain()).
+
+    With unified continuation, prop data cut short (as the API does
+    for responses which get too large) comes in the next responses,
+    for the same pages. Wikis with only the legacy ``query-continue``
+    continue the generator alone, so the pages left out are fetched
+    with ``prop_type`` operations of their own.
+    """
+    generator_type = None
+    prop_type = None
+    prop_names = frozenset()   # the prop modules, e.g., in query-continue
+    result_keys = frozenset()  # the prop data in each page
+
+    def __init__(self, input_param, limit=None, **kw):
+        self._fallback_titles = []
+        self._is_prop_cut_short = False
+        self._is_unified = False
+        super(FusedQueryOperation, self).__init__(input_param, limit, **kw)
+
+    def _set_params(self):
+        super(FusedQueryOperation, self)._set_params()
+        prop_type = self.prop_type
+        prop_params = get_field_params(prop_type.fields,
+                                       prop_type.field_prefix,
+                                       self.kwargs)
+        self.params = merge_query_params(self.params, prop_params)
+        # until the wiki is known to continue prop data, no more pages
+        # per query than the prop query takes titles
+        field_limit = prop_type.input_field.limit or PL_50_500
+        try:
+            title_limit = field_limit.get_limit(self.is_bot_op)
+        except AttributeError:
+            title_limit = int(field_limit)
+        self._title_limit = title_limit
+        self._uncapped_limit = self.per_query_limit
+        self.per_query_limit = min(self.per_query_limit, title_limit)
+
+    @property
+    def remaining(self):
+        if self._fallback_titles:
+            # the generator may be done, but some of its pages aren't
+            return super(QueryOperation, self).remaining
+        return super(FusedQueryOperation, self).remaining
+
+    def _make_prop_op(self, titles):
+        ret = self.prop_type(titles, client=self.client, **self.kwargs)
+        ret.stats.parent = self.stats
+        return ret
+
+    def process(self):
+        if self._fallback_titles:
+            # independent of the continuation, so not pipelined
+            return super(QueryOperation, self).process()
+        return super(FusedQueryOperation, self).process()
+
+    def get_current_tasks(self, count=1):
+        if not self._fallback_titles:
+            return super(FusedQueryOperation, self).get_current_tasks(count)
+        titles = self._fallback_titles[:count]
+        del self._fallback_titles[:count]
+        return [self._make_prop_op(title).process_all for title in titles]
+
+    def extract_results(self, query_resp):
+        pages = []
+        for page_id, pid_dict in query_resp.get('pages', {}).items():
+            if not self.result_keys.intersection(pid_dict):
+                if self._is_prop_cut_short:
+                    self._fallback_titles.append(pid_dict['title'])
+                # otherwise it's in another response for the same pages
+                continue
+            pages.append((page_id, pid_dict))
+        ret = []
+        # the prop operation knows best how to read its own data, so
+        # one reads each batch of pages it could have queried itself
+        for chunk in chunked_iter(pages, self._title_limit):
+            prop_op = self._make_prop_op([pid_dict['title']
+                                          for _, pid_dict in chunk])
+            ret.extend(prop_op.extract_results({'pages': dict(chunk)}))
+        return ret
+
+    def store_results(self, task, resp):
+        if not isinstance(task, MediaWikiCall):
+            return self._update_results(resp)  # from a fallback prop_op
+        results = resp.results
+        if 'continue' in results or 'batchcomplete' in results:
+            if not self._is_unified:
+                # nothing is cut short for good, so no need for the cap
+                self._is_unified = True
+                self.per_query_limit = max(self.per_query_limit,
+                                           self._uncapped_limit)
+            self._is_prop_cut_short = False
+        else:
+            # legacy query-continue, followed for the generator only
+            qc_val = results.get(self.api_action + '-continue') or {}
+            self._is_prop_cut_short = bool(
+                self.prop_names.intersection(qc_val))
+        return super(FusedQueryOperation, self).store_results(task, resp)
+
+    def _get_state(self):
+        ret = super(FusedQueryOperation, self)._get_state()
+        ret['fallback_titles'] = list(self._fallback_titles)
+        ret['is_unified'] = self._is_unified
+        return ret
+
+    def _set_state(self, state):
+        super(FusedQueryOperation, self)._set_state(state)
+        self._fallback_titles = list(state['fallback_titles'])
+        self._is_unified = state.get('is_unified', False)
+
+
+def get_field_params(fields, field_prefix, kwargs):
+    return dict([(field.get_key(field_prefix),
+                  field.get_value(kwargs.get(field.key)))
+                 for field in fields])
+
+
+def merge_query_params(params, other_params):
+    """
+    Combines the parameters of two queries, joining the values of
+    ``prop`` and of the modules' own prop lists (e.g., ``inprop``).
+    Raises a ValueError if any other parameter conflicts.
+    """
+    ret = dict(params)
+    for key, value in other_params.items():
+        if key not in ret or ret[key] == value:
+            ret[key] = value
+        elif key.endswith('prop'):
+            props = ret[key].split('|')
+            props.extend([p for p in value.split('|') if p not in props])
+            ret[key] = '|'.join(props)
+        else:
+            raise ValueError('conflicting values for query parameter %r:'
+                             ' %r and %r' % (key, ret[key], value))
+    return ret
+
+
+def _has_default_query_methods(op_type):
+    for name in ('prepare_params', 'post_process_response', 'get_cont_str'):
+        if getattr(op_type, name).im_func is not \
+                getattr(QueryOperation, name).im_func:
+            return False
+    return True
+
+
+def is_fusable(generator_type, prop_type):
+    """
+    Whether a subop chain step of ``generator_type`` followed by
+    one of ``prop_type`` can be sent as one query. That is, the first
+    is a plain generator query yielding pages, and the second a plain
+    prop query taking them by title, with no parameters in conflict.
+    Wrapped types (e.g., ``Recursive(...)``) are never fused.
+    """
+    for op_type in (generator_type, prop_type):
+        if not isinstance(op_type, OperationMeta) or \
+                not issubclass(op_type, QueryOperation) or \
+                issubclass(op_type, FusedQueryOperation) or \
+                op_type.api_action != 'query' or \
+                not _has_default_query_methods(op_type):
+            return False
+    gen_params = get_field_params(generator_type.fields,
+                                  generator_type.field_prefix, {})
+    prop_params = get_field_params(prop_type.fields,
+                                   prop_type.field_prefix, {})
+    if 'generator' not in gen_params or generator_type.is_bijective:
+        return False
+    prop_field = prop_type.input_field
+    if 'prop' not in prop_params or 'generator' in prop_params \
+            or 'list' in prop_params or not prop_type.is_bijective \
+            or prop_field is None or prop_field.key != 'titles':
+        return False
+    if not prop_type.result_keys:
+        return False  # no telling which pages the prop data was cut from
+    try:
+        merge_query_params(gen_params, prop_params)
+    except ValueError:
+        return False
+    return True
+
+
+def fuse_query_types(generator_type, prop_type, module_name):
+    """
+    Makes a FusedQueryOperation type for ``generator_type`` followed
+    by ``prop_type``. The type is added to the module named
+    ``module_name``, so that operations using it can be pickled (see
+    Operation.checkpoint()).
+    """
+    prop_params = get_field_params(prop_type.fields,
+                                   prop_type.field_prefix, {})
+    name = str('Fused%s%s' % (generator_type.__name__, prop_type.__name__))
+    attrs = {'__module__': module_name,
+             '__doc__': ('%s and %s, in one query.'
+                         % (generator_type.__name__, prop_type.__name__)),
+             'generator_type': generator_type,
+             'prop_type': prop_type,
+             'prop_names': frozenset(prop_params['prop'].split('|')),
+             'result_keys': frozenset(prop_type.result_keys),
+             'input_field': generator_type.input_field,
+             'field_prefix': generator_type.field_prefix,
+             'fields': generator_type.fields,
+             'per_query_limit': generator_type.per_query_limit,
+             'default_limit': generator_type.default_limit,
+             'output_type': [prop_type.singular_output_type]}
+    ret = OperationMeta(name, (FusedQueryOperation,), attrs)
+    setattr(sys.modules[module_name], name, ret)
+    return ret
+
+
+def plan_subop_chain(op_type):
+    """
+    Returns ``op_type``'s subop chain, with each fusable pair of steps
+    (see is_fusable()) replaced by a single FusedQueryOperation step.
+    Operations use this chain unless created with ``fuse=False``.
+    """
+    ret = []
+    for subop_type in op_type.subop_chain:
+        if ret and is_fusable(ret[-1], subop_type):
+            ret[-1] = fuse_query_types(ret[-1], subop_type,
+                                       op_type.__module__)
+        else:
+            ret.append(subop_type)
+    return ret
+
+
 BASE_API_PARAMS = {'format': 'json',
                    'servedby': 'true'}
 
+MAXLAG_RETRIES = 5
+# blank values are normally left out of requests, but a blank
+# 'continue' starts a query with unified continuation
+KEEP_BLANK_PARAMS = ('continue',)
+DEFAULT_MAXLAG_DELAY = 5  # when the server doesn't send Retry-After
+
 
 class MediaWikiCall(Operation):
     """
@@ -644,23 +1344,37 @@ class MediaWikiCall(Operation):
         self.raise_exc = kw.pop('raise_exc', True)
         self.raise_err = kw.pop('raise_err', True)
         self.raise_warn = kw.pop('raise_warn', False)
+        # the param which may be reduced on timeout, e.g., 'gcmlimit'
+        self.limit_key = kw.pop('limit_key', None)
         self.client = kw.pop('client')
         self.web_client = getattr(self.client,
                                      'web_client',
                                      DEFAULT_WEB_CLIENT)
+        self.retry_policy = getattr(self.client, 'retry_policy', None)
         if kw:
             raise ValueError('got unexpected keyword arguments: %r'
                              % kw.keys())
         self.api_url = self.client.api_url
         params = params or {}
         self.params = dict(BASE_API_PARAMS)
+        # opt-in, seconds of replication lag to tolerate, see process()
+        maxlag = getattr(self.client, 'maxlag', None)
+        if maxlag is not None:
+            self.params['maxlag'] = maxlag
         self.params.update(params)
         self.action = params['action']
 
+        self.response_cache = getattr(self.client, 'response_cache', None)
+        self.stats = OperationStats(parent=getattr(self.client, 'stats', None))
+
         self.url = ''
         self.results = None
+        self.from_cache = False
+        self.json_time = None
         self.servedby = None
+        self.retry_count = 0
         self.exception = None
+        self._exc_info = None
         self.error = None
         self.error_code = None
         self.warnings = []
@@ -669,31 +1383,31 @@ class MediaWikiCall(Operation):
 
     def process(self):
         # TODO: add URL to all exceptions
-        resp = None
-        try:
-            resp = self.web_client.get(self.api_url, self.params)
-        except Exception as e:
-            # TODO: log
-            self.exception = e  # TODO: wrap
-            if self.raise_exc:
-                raise
-            return self
-        finally:
-            self.url = getattr(resp, 'url', '')
-
-        try:
-            self.results = json.loads(resp.text)
-        except Exception as e:
-            self.exception = e  # TODO: wrap
+        self.stats.add(ops_executed=1)
+        policy = self.retry_policy
+        lag_retries = 0
+        while True:
+            resp = self._call()
+            if self.exception:
+                if policy is None:
+                    break
+                policy.record_failure()
+                if not policy.should_retry(self.exception, self.retry_count):
+                    break
+                self._wait_for_retry()
+                continue
+            if policy is not None:
+                policy.record_success()
+            if self.error_code != 'maxlag' or lag_retries >= MAXLAG_RETRIES:
+                break
+            lag_retries += 1
+            self.stats.add(retries=1)
+            self._wait_for_lag(resp)
+        if self.exception:
             if self.raise_exc:
-                raise
+                exc_type, exc_val, exc_tb = self._exc_info
+                raise exc_type, exc_val, exc_tb
             return self
-        self.servedby = self.results.get('servedby')
-
-        error = self.results.get('error')
-        if error:
-            self.error = error.get('info')
-            self.error_code = error.get('code')
 
         warnings = self.results.get('warnings', {})
         for mod_name, warn_dict in warnings.items():
@@ -706,6 +1420,89 @@ class MediaWikiCall(Operation):
             raise WapitiException('warnings: %r' % self.warnings)
         return self
 
+    def _wait_for_retry(self):
+        exc, policy = self.exception, self.retry_policy
+        delay = policy.get_delay(self.retry_count, exc)
+        self.retry_count += 1
+        self.stats.add(retries=1)
+        if policy.shrink_on_timeout and is_timeout(exc):
+            self._shrink_limit()
+        time.sleep(delay)
+
+    def _shrink_limit(self):
+        try:
+            limit = int(self.params[self.limit_key])
+        except (KeyError, TypeError, ValueError):
+            return
+        self.params[self.limit_key] = max(1, limit // 2)
+
+    def _call(self):
+        """
+        Makes a single request, returning the ransom.Response, if any.
+        Exceptions are stored on the call, process() decides whether
+        to retry or reraise them.
+        """
+        self.exception = self.error = self.error_code = None
+        self._exc_info = None
+        resp = resp_text = None
+        if self.response_cache is not None:
+            resp_text = self.response_cache.get(self.api_url, self.params)
+        if resp_text is not None:
+            self.from_cache = True
+            self.url = ransom.construct_url(self.api_url, self.params,
+                                            KEEP_BLANK_PARAMS)
+            self.stats.add(cache_hits=1)
+        else:
+            try:
+                resp = self.web_client.get(self.api_url, self.params,
+                                           keep_blank=KEEP_BLANK_PARAMS)
+                resp_text = resp.text
+            except Exception as e:
+                # TODO: log
+                self.exception = e  # TODO: wrap
+                self._exc_info = sys.exc_info()
+                self._record_request(None, action=self.action,
+                                     error=repr(e))
+                return resp
+            self.url = resp.url
+
+        start_time = time.time()
+        try:
+            self.results = json.loads(resp_text)
+        except Exception as e:
+            self.exception = e  # TODO: wrap
+            self._exc_info = sys.exc_info()
+            self.stats.add(errors=1)
+            return resp
+        self.json_time = time.time() - start_time
+        self.stats.add(json_time=self.json_time)
+        self.servedby = self.results.get('servedby')
+
+        error = self.results.get('error')
+        if error:
+            self.error = error.get('info')
+            self.error_code = error.get('code')
+            self.stats.add(errors=1)
+        elif self.response_cache is not None and not self.from_cache:
+            self.response_cache.set(self.api_url, self.params, resp_text)
+        if not self.from_cache:
+            self.stats.add(servedby=self.servedby)
+            self._record_request(resp, action=self.action,
+                                 servedby=self.servedby,
+                                 json_time=self.json_time,
+                                 error_code=self.error_code)
+        return resp
+
+    def _wait_for_lag(self, resp):
+        # the rate limiter already backed off if Retry-After was sent
+        retry_after = getattr(resp, 'retry_after', None)
+        delay = DEFAULT_MAXLAG_DELAY if retry_after is None else retry_after
+        limiter = getattr(self.web_client, 'rate_limiter', None)
+        if limiter is None:
+            time.sleep(delay)
+        elif retry_after is None:
+            limiter.backoff(delay)
+
     @property
     def notices(self):
         ret = []
@@ -743,16 +1540,20 @@ class WebRequestOperation(Operation):
         self.url = self._input_param
         self.kwargs = kw
         self.results = {}
+        self.stats = OperationStats(parent=getattr(self.client, 'stats', None))
 
     def process(self):
+        self.stats.add(ops_executed=1)
         resp = None
         try:
             resp = self.web_client.req(self.action, self.url)
         except Exception as e:
             self.exception = e
+            self._record_request(None, error=repr(e))
             if self.raise_exc:
                 raise
             return self
+        self._record_request(resp)
         self.results[self.url] = resp.text
         raise NoMoreResults()
         #return self
@@ -781,12 +1582,15 @@ class GetPageHTML(Operation):
         self.results = {}
 
     def process(self):
+        self._mark_started()
         try:
             resp = self.web_client.get(self.url)
         except Exception as e:
             self.exception = e
+            self._record_request(None, error=repr(e))
             if self.raise_exc:
                 raise
             return self
+        self._record_request(resp)
         self.results[self.url] = resp.text
         raise NoMoreResults()
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+    wapiti.operations.batch
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Runs several title-based prop operations over the same titles,
+    with one query per batch of titles for all of them, instead of
+    one per operation::
+
+        get_batch = client.batch_query(titles, op_types=[GetPageInfo,
+                                                         GetCoordinates,
+                                                         GetLanguageLinks])
+        get_batch()
+        coords = get_batch.get_results(GetCoordinates)
+
+    The operations' ``prop`` parameters are merged (e.g.,
+    ``prop=info|coordinates|langlinks``), and each response is handed
+    to every operation to extract its own results. While any module
+    continues (e.g., more language links than fit in one response),
+    the batch is queried again, with the unified continuation of all
+    the modules. Only the operations whose modules continue read the
+    responses which follow. On wikis with only the legacy
+    ``query-continue``, those operations are queried alone instead.
+"""
+from __future__ import unicode_literals
+
+import time
+from collections import OrderedDict, deque
+
+from base import (Operation,
+                  QueryOperation,
+                  MediaWikiCall,
+                  NoMoreResults,
+                  PL_50_500,
+                  get_field_params,
+                  merge_query_params)
+from params import MultiParam
+from utils import chunked_iter
+
+
+def is_batchable(op_type):
+    """
+    Whether ``op_type`` is a query operation which takes pages by
+    title and gets their prop data (e.g., GetPageInfo), as opposed to
+    generating or listing pages.
+    """
+    if not isinstance(op_type, type) or \
+            not issubclass(op_type, QueryOperation) or \
+            op_type.api_action != 'query':
+        return False
+    input_field = op_type.input_field
+    if input_field is None or input_field.key != 'titles' or \
+            input_field.val_prefix:
+        return False
+    params = get_field_params(op_type.fields, op_type.field_prefix, {})
+    return 'prop' in params and \
+        'generator' not in params and 'list' not in params
+
+
+def _is_continued(op, cont_params):
+    # e.g., 'llcontinue' for GetLanguageLinks; 'continue' itself only
+    # tracks the progress of the whole query
+    prefix = op.field_prefix or ''
+    return any([key.startswith(prefix) and key.endswith('continue')
+                and key != 'continue' for key in cont_params])
+
+
+class BatchQuery(Operation):
+    """
+    Runs the prop operations in ``op_types`` (e.g., ``[GetPageInfo,
+    GetProtections]``) on the same titles, one combined query per
+    batch. Other keyword arguments go to each of the operations.
+    Results of all the operations come out together, in batch order;
+    use get_results() to get those of one operation.
+    """
+    input_field = MultiParam('titles', key_prefix=False)
+    output_type = [object]  # the results of each of op_types
+
+    def __init__(self, input_param, limit=None, **kw):
+        op_types = kw.get('op_types')
+        if not op_types:
+            raise ValueError('expected op_types, a list of operation types')
+        super(BatchQuery, self).__init__(input_param, limit, **kw)
+        self.op_types = list(op_types)
+        self.op_kwargs = dict(self.kwargs)
+        self.op_kwargs.pop('op_types')
+
+        params = {}
+        for op_type in self.op_types:
+            if not is_batchable(op_type):
+                raise ValueError('%s cannot be batched, expected a query'
+                                 ' operation taking titles, with a prop'
+                                 % op_type.__name__)
+            op_params = get_field_params(op_type.fields,
+                                         op_type.field_prefix,
+                                         self.op_kwargs)
+            # raises a ValueError if the operations conflict
+            params = merge_query_params(params, op_params)
+
+        titles = list(OrderedDict.fromkeys(self.input_param_list))
+        self._chunks = deque(chunked_iter(titles, self.chunk_size))
+
+    @property
+    def chunk_size(self):
+        ret = []
+        for op_type in self.op_types:
+            field_limit = op_type.input_field.limit or PL_50_500
+            try:
+                ret.append(field_limit.get_limit(self.is_bot_op))
+            except AttributeError:
+                ret.append(int(field_limit))
+        return min(ret)
+
+    def process(self):
+        self._mark_started()
+        if not self.remaining or not self._chunks:
+            raise NoMoreResults()
+        # chunks share no continuation state, so they run concurrently
+        count = min(len(self._chunks), self.executor.max_workers)
+        chunks = [self._chunks.popleft() for _ in range(count)]
+        chunk_results = self.executor.map(self._process_chunk, chunks)
+        new_results = []
+        for results in chunk_results:
+            new_results.extend(self._update_results(results))
+        return new_results
+
+    def _process_chunk(self, titles):
+        # may run outside of the calling thread, see Operation.process()
+        ops = []
+        for op_type in self.op_types:
+            op = op_type(titles, client=self.client, **self.op_kwargs)
+            op.stats.parent = self.stats
+            ops.append(op)
+        query_params = {}
+        for op in ops:
+            query_params = merge_query_params(query_params,
+                                              op.prepare_params())
+        ret, params, active_ops = [], query_params, ops
+        while active_ops:
+            mw_call = MediaWikiCall(params, client=self.client)
+            mw_call.stats.parent = self.stats
+            mw_call.process()
+            start_time = time.time()
+            for op in active_ops:
+                query_resp = op.post_process_response(mw_call)
+                if query_resp is not None:
+                    ret.extend([(type(op), res)
+                                for res in op.extract_results(query_resp)])
+            self.stats.add(extract_time=time.time() - start_time)
+
+            results = mw_call.results
+            if 'continue' in results:
+                # the API skips the modules which are already done
+                cont_params = dict(results['continue'])
+                active_ops = [op for op in active_ops
+                              if _is_continued(op, cont_params)]
+                params = dict(query_params, **cont_params)
+                continue
+            cont_params = {}
+            for module_cont in (results.get('query-continue') or {}).values():
+                cont_params.update(module_cont)
+            active_ops = [op for op in active_ops
+                          if _is_continued(op, cont_params)]
+            params = {}
+            for op in active_ops:
+                params = merge_query_params(params, op.prepare_params())
+            params.update(cont_params)
+        return ret
+
+    def _update_results(self, results):
+        ret = []
+        for op_type, res in results:
+            if not self.remaining:
+                break
+            unique_key = (op_type.__name__,
+                          getattr(res, 'unique_key', res))
+            if unique_key in self.results:
+                continue
+            if self.keep_results:
+                self.results[unique_key] = res
+            else:
+                self.results.add(unique_key)
+            ret.append(res)
+        return ret
+
+    def get_results(self, op_type):
+        """
+        Returns the results so far of the operation ``op_type``. Only
+        stored results can be split up, so once the batch is streamed
+        with iter_results(), this raises a ValueError.
+        """
+        if not self.keep_results:
+            raise ValueError('results are not kept once streaming, sort'
+                             ' the results of iter_results() by type'
+                             ' instead')
+        return [res for (op_name, _), res in self.results.items()
+                if op_name == op_type.__name__]
+
+    def _get_state(self):
+        ret = super(BatchQuery, self)._get_state()
+        ret['chunks'] = list(self._chunks)
+        return ret
+
+    def _set_state(self, state):
+        super(BatchQuery, self)._set_state(state)
+        self._chunks = deque(state['chunks'])
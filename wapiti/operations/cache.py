@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+    wapiti.operations.cache
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    An opt-in, on-disk cache of raw MediaWiki API responses, for
+    workloads which ask the same questions many times a day. Enable it
+    by passing a ``ResponseCache`` to the ``WapitiClient``::
+
+        client = WapitiClient('you@example.com',
+                              response_cache=ResponseCache())
+
+    Responses are keyed on the normalized API URL plus the sorted
+    request parameters, stored zlib-compressed in a SQLite database,
+    and expire after a per-action TTL. Revision lookups by revision ID
+    are immutable, and are kept until evicted. Once the cache grows
+    past ``max_size`` bytes, the least recently used responses are
+    evicted first.
+
+    Separately, a ``SiteInfoCache`` keeps each wiki's siteinfo (see
+    meta.GetSourceInfo) on disk, so that many short-lived clients of
+    the same wiki share a single fetch. It's opt-in too::
+
+        client = WapitiClient('you@example.com',
+                              siteinfo_cache=SiteInfoCache())
+"""
+from __future__ import unicode_literals
+
+import os
+import time
+import zlib
+import hashlib
+import threading
+import cPickle as pickle
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # no locking between processes, e.g., on Windows
+
+from urllib import urlencode
+from urlparse import urlparse
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'wapiti')
+DEFAULT_TTL = 60 * 60
+DEFAULT_TTLS = {'query': 60 * 60}  # action -> seconds, None = forever
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+DEFAULT_SITEINFO_TTL = 24 * 60 * 60
+SITEINFO_CACHE_VERSION = 1
+
+_CREATE_TABLE = ('CREATE TABLE IF NOT EXISTS responses'
+                 ' (key TEXT PRIMARY KEY, action TEXT, value BLOB,'
+                 ' size INTEGER, expires REAL, accessed REAL)')
+_CREATE_INDEX = ('CREATE INDEX IF NOT EXISTS responses_accessed'
+                 ' ON responses (accessed)')
+
+
+def normalize_api_url(api_url):
+    parsed = urlparse(api_url.strip())
+    path = parsed.path or '/'
+    return '%s://%s%s' % (parsed.scheme.lower(), parsed.netloc.lower(), path)
+
+
+def get_cache_key(api_url, params):
+    # encoded like the request itself (see ransom.encode_url_params):
+    # lists become repeated parameters, and blank parameters are
+    # ignored, except for 'continue' (see base.KEEP_BLANK_PARAMS)
+    items = []
+    for k, vs in params.items():
+        if not hasattr(vs, '__iter__') or isinstance(vs, basestring):
+            vs = [vs]
+        for v in vs:
+            if v is None or (not v and k != 'continue'):
+                continue
+            items.append((unicode(k).encode('utf-8'),
+                          unicode(v).encode('utf-8')))
+    items.sort(key=lambda item: item[0])  # repeated values keep order
+    key_str = normalize_api_url(api_url) + '?' + urlencode(items)
+    return hashlib.sha1(key_str.encode('utf-8')).hexdigest()
+
+
+def is_immutable(params):
+    if params.get('action') != 'query' or not params.get('revids'):
+        return False
+    return 'revisions' in unicode(params.get('prop', '')).split('|')
+
+
+class ResponseCache(object):
+    def __init__(self, path=None, default_ttl=DEFAULT_TTL, ttls=None,
+                 max_size=DEFAULT_MAX_SIZE):
+        if path is None:
+            if not os.path.isdir(DEFAULT_CACHE_DIR):
+                os.makedirs(DEFAULT_CACHE_DIR)
+            path = os.path.join(DEFAULT_CACHE_DIR, 'responses.db')
+        self.path = path
+        self.default_ttl = default_ttl
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        import sqlite3  # only response caches need it, and they're opt-in
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.text_factory = bytes
+        with self._conn:
+            self._conn.execute(_CREATE_TABLE)
+            self._conn.execute(_CREATE_INDEX)
+        cur = self._conn.execute('SELECT SUM(size) FROM responses')
+        self._total_size = cur.fetchone()[0] or 0
+
+    def get_ttl(self, params):
+        """
+        Returns the number of seconds a response to ``params`` stays
+        fresh. None means forever, 0 means not to cache it at all.
+        """
+        if is_immutable(params):
+            return None
+        return self.ttls.get(params.get('action'), self.default_ttl)
+
+    def get(self, api_url, params):
+        key = get_cache_key(api_url, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT value, size, expires FROM'
+                                     ' responses WHERE key = ?',
+                                     (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, size, expires = row
+            with self._conn:
+                if expires is not None and expires < now:
+                    self._conn.execute('DELETE FROM responses WHERE key = ?',
+                                       (key,))
+                    self._total_size -= size
+                    self.misses += 1
+                    return None
+                self._conn.execute('UPDATE responses SET accessed = ?'
+                                   ' WHERE key = ?', (now, key))
+            self.hits += 1
+        return zlib.decompress(value)
+
+    def set(self, api_url, params, text):
+        ttl = self.get_ttl(params)
+        if ttl == 0:
+            return
+        key = get_cache_key(api_url, params)
+        now = time.time()
+        expires = None if ttl is None else now + ttl
+        value = zlib.compress(text)
+        size = len(value)
+        with self._lock:
+            with self._conn:
+                row = self._conn.execute('SELECT size FROM responses'
+                                         ' WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self._total_size -= row[0]
+                self._conn.execute('INSERT OR REPLACE INTO responses VALUES'
+                                   ' (?, ?, ?, ?, ?, ?)',
+                                   (key, params.get('action'),
+                                    buffer(value), size,  # a BLOB
+                                    expires, now))
+                self._total_size += size
+                if self._total_size > self.max_size:
+                    self._evict()
+
+    def _evict(self):
+        # LRU down to 90% of the cap, to leave some headroom
+        target_size = self.max_size * 0.9
+        cur = self._conn.execute('SELECT key, size FROM responses'
+                                 ' ORDER BY accessed')
+        evicted = []
+        for key, size in cur:
+            if self._total_size <= target_size:
+                break
+            evicted.append((key,))
+            self._total_size -= size
+        self._conn.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+    def clear(self):
+        with self._lock:
+            with self._conn:
+                self._conn.execute('DELETE FROM responses')
+            self._total_size = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @property
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute('SELECT COUNT(*) FROM'
+                                       ' responses').fetchone()[0]
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'count': count,
+                'size': self._total_size}
+
+    def __len__(self):
+        return self.stats['count']
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return '<%s %r hits=%d misses=%d>' % (cn, self.path,
+                                              self.hits, self.misses)
+
+
+class SiteInfoCache(object):
+    """
+    Keeps the siteinfo (a models.SourceInfo) of each wiki in a pickle
+    file under ``path``, named by the hash of the wiki's normalized
+    API URL, for ``ttl`` seconds (None is forever).
+
+    ``get_or_fetch()`` takes a file lock before fetching, so when many
+    processes start at once, one of them fetches and the rest wait for
+    its result. Nothing is created under ``path`` until then.
+    """
+    def __init__(self, path=None, ttl=DEFAULT_SITEINFO_TTL):
+        if path is None:
+            path = DEFAULT_CACHE_DIR
+        self.path = path
+        self.ttl = ttl
+
+    def _ensure_dir(self):
+        try:
+            os.makedirs(self.path)
+        except OSError:
+            if not os.path.isdir(self.path):
+                raise
+
+    def _get_file_path(self, api_url):
+        url_hash = hashlib.sha1(normalize_api_url(api_url).encode('utf-8'))
+        return os.path.join(self.path, 'siteinfo-%s.pickle'
+                            % url_hash.hexdigest())
+
+    def get(self, api_url):
+        try:
+            with open(self._get_file_path(api_url), 'rb') as f:
+                state = pickle.load(f)
+        except Exception:
+            return None  # missing, or unpickling failed; either way, refetch
+        if state.get('version') != SITEINFO_CACHE_VERSION:
+            return None
+        if self.ttl is not None and state['fetched'] + self.ttl < time.time():
+            return None
+        return state['source_info']
+
+    def set(self, api_url, source_info):
+        file_path = self._get_file_path(api_url)
+        state = {'version': SITEINFO_CACHE_VERSION,
+                 'api_url': api_url,
+                 'fetched': time.time(),
+                 'source_info': source_info}
+        self._ensure_dir()
+        tmp_path = '%s.%d.tmp' % (file_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, file_path)
+
+    @contextmanager
+    def _locked(self, api_url):
+        if fcntl is None:
+            yield
+            return
+        self._ensure_dir()
+        with open(self._get_file_path(api_url) + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_or_fetch(self, api_url, fetch):
+        """
+        Returns the cached siteinfo for ``api_url``, or calls ``fetch``
+        to get it, and caches that.
+        """
+        ret = self.get(api_url)
+        if ret is not None:
+            return ret
+        with self._locked(api_url):
+            ret = self.get(api_url)  # another process may have fetched it
+            if ret is None:
+                ret = fetch()
+                self.set(api_url, ret)
+        return ret
+
+    def clear(self, api_url):
+        try:
+            os.remove(self._get_file_path(api_url))
+        except OSError:
+            pass
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return '<%s %r ttl=%r>' % (cn, self.path, self.ttl)
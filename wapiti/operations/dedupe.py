@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+    wapiti.operations.dedupe
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Key stores remember which parameters an OperationQueue has already
+    enqueued, and which results a streaming Operation has already
+    produced. For most operations a plain set is just fine, but on a
+    multi-million page traversal those sets become a sizable chunk of
+    the memory footprint. All stores support ``add()``, ``in`` and
+    ``len()``, and are selected via the client's ``key_store_type``,
+    a callable returning a new, empty store:
+
+    - ``ExactKeyStore``: a set. The default.
+    - ``CompactKeyStore``: exact, but stores non-negative integers
+      (e.g., page IDs) in a bitmap and strings (e.g., titles) as
+      interned UTF-8 bytestrings.
+    - ``BloomKeyStore``: a Bloom filter, with memory use fixed by its
+      capacity and false positive rate. A false positive means a
+      parameter or result is mistaken for a duplicate and skipped, so
+      pick an error rate the crawl can tolerate, e.g.,
+      ``partial(BloomKeyStore, 10 ** 7, 0.0001)``.
+"""
+from __future__ import unicode_literals
+
+import math
+import struct
+import hashlib
+
+
+class ExactKeyStore(object):
+    def __init__(self):
+        self._keys = set()
+
+    def add(self, key):
+        self._keys.add(key)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return '<%s (%d keys)>' % (self.__class__.__name__, len(self))
+
+
+_PAGE_BITS = 16
+_PAGE_MASK = (1 << _PAGE_BITS) - 1
+_PAGE_BYTES = (1 << _PAGE_BITS) // 8
+
+
+class CompactKeyStore(ExactKeyStore):
+    """
+    The integer bitmap is allocated in 8kB pages, each covering a
+    range of 65536 integers, so it is most compact for dense integer
+    keys like page IDs. Keys which are neither strings nor
+    non-negative integers (e.g., tuples) go in a plain set.
+    """
+    def __init__(self):
+        super(CompactKeyStore, self).__init__()
+        self._pages = {}
+        self._int_count = 0
+
+    def _locate(self, key):
+        if isinstance(key, bool) or not isinstance(key, (int, long)) \
+                or key < 0:
+            return None
+        page_no, bit_no = key >> _PAGE_BITS, key & _PAGE_MASK
+        return page_no, bit_no >> 3, 1 << (bit_no & 7)
+
+    def _norm_str(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        if isinstance(key, bytes):
+            return intern(key)
+        return key
+
+    def add(self, key):
+        loc = self._locate(key)
+        if loc is None:
+            self._keys.add(self._norm_str(key))
+            return
+        page_no, byte_no, bit = loc
+        try:
+            page = self._pages[page_no]
+        except KeyError:
+            page = self._pages[page_no] = bytearray(_PAGE_BYTES)
+        if not page[byte_no] & bit:
+            page[byte_no] |= bit
+            self._int_count += 1
+
+    def __contains__(self, key):
+        loc = self._locate(key)
+        if loc is None:
+            return self._norm_str(key) in self._keys
+        page_no, byte_no, bit = loc
+        page = self._pages.get(page_no)
+        return bool(page and page[byte_no] & bit)
+
+    def __len__(self):
+        return self._int_count + len(self._keys)
+
+
+class BloomKeyStore(object):
+    """
+    A classic Bloom filter sized for ``capacity`` keys at the given
+    false positive rate. Adding more than ``capacity`` keys works, but
+    the false positive rate climbs accordingly. ``len()`` counts keys
+    added which were not already (apparently) present.
+    """
+    def __init__(self, capacity=10 ** 6, error_rate=0.001):
+        if not 0 < error_rate < 1:
+            raise ValueError('expected error_rate between 0 and 1')
+        self.capacity = int(capacity)
+        self.error_rate = error_rate
+        ln2 = math.log(2)
+        bit_count = -self.capacity * math.log(error_rate) / (ln2 * ln2)
+        self.bit_count = max(8, int(math.ceil(bit_count)))
+        self.hash_count = max(1, int(round(ln2 * self.bit_count
+                                           / self.capacity)))
+        self._bits = bytearray((self.bit_count + 7) // 8)
+        self._count = 0
+
+    def _get_offsets(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        elif not isinstance(key, bytes):
+            key = repr(key)
+        h1, h2 = struct.unpack(b'<QQ', hashlib.md5(key).digest())
+        bit_count = self.bit_count
+        return [(h1 + i * h2) % bit_count for i in xrange(self.hash_count)]
+
+    def add(self, key):
+        bits, is_new = self._bits, False
+        for offset in self._get_offsets(key):
+            bit = 1 << (offset & 7)
+            if not bits[offset >> 3] & bit:
+                bits[offset >> 3] |= bit
+                is_new = True
+        if is_new:
+            self._count += 1
+
+    def __contains__(self, key):
+        bits = self._bits
+        for offset in self._get_offsets(key):
+            if not bits[offset >> 3] & (1 << (offset & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self._count
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return ('<%s capacity=%d error_rate=%r (%d keys)>'
+                % (cn, self.capacity, self.error_rate, len(self)))
+
+
+DEFAULT_KEY_STORE_TYPE = ExactKeyStore
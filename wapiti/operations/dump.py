@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+    wapiti.operations.dump
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Reads revisions straight out of MediaWiki XML dumps (e.g.,
+    ``enwiki-latest-pages-articles.xml.bz2``), as an offline stand-in
+    for the API-backed content operations. Dumps are parsed
+    incrementally, one page at a time, so memory use stays flat no
+    matter the size of the dump::
+
+        get_tmpls = client.get_dump_parsed_templates('pages-articles.xml.bz2')
+        for tmpl in get_tmpls.iter_results():
+            print tmpl.name
+
+    Revisions come out as ``models.Revision`` objects, like those of
+    ``GetCurrentContent``, so anything which consumes page content
+    (e.g., ``GetParsedTemplates``) works on them unchanged. Plain,
+    bzip2 (including multistream) and gzip dumps are supported.
+"""
+from __future__ import unicode_literals
+
+import bz2
+import gzip
+from itertools import islice
+
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+from base import Operation, NoMoreResults
+from params import PassthroughParam
+from models import Revision
+from templates import GetParsedTemplates
+
+
+DEFAULT_BATCH_SIZE = 100
+READ_SIZE = 1024 * 1024
+_EVENTS = (b'start', b'end')  # cElementTree rejects unicode event names
+
+_PAGE_FIELDS = {'title': 'title', 'ns': 'ns', 'id': 'pageid'}
+_REVISION_FIELDS = {'id': 'revid', 'parentid': 'parentid',
+                    'timestamp': 'timestamp', 'comment': 'comment',
+                    'text': '*'}
+_CONTRIBUTOR_FIELDS = {'username': 'user', 'ip': 'user', 'id': 'userid'}
+_INT_FIELDS = ('ns', 'pageid', 'revid', 'parentid', 'userid')
+
+
+class BZ2MultiStreamFile(object):
+    """
+    A minimal read-only file around bzip2 data which, unlike
+    ``bz2.BZ2File``, keeps reading past the end of the first stream,
+    as needed for the "multistream" dumps.
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self._decomp = bz2.BZ2Decompressor()
+        self._buffer = b''
+        self._eof = False
+
+    def _fill(self, size):
+        while not self._eof and len(self._buffer) < size:
+            data = self.fileobj.read(READ_SIZE)
+            if not data:
+                self._eof = True
+                break
+            while data:
+                try:
+                    self._buffer += self._decomp.decompress(data)
+                except EOFError:
+                    # end of stream, the rest of the data starts another
+                    self._decomp = bz2.BZ2Decompressor()
+                    continue
+                data = self._decomp.unused_data
+                if data:
+                    self._decomp = bz2.BZ2Decompressor()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            self._fill(float('inf'))
+            size = len(self._buffer)
+        else:
+            self._fill(size)
+        ret, self._buffer = self._buffer[:size], self._buffer[size:]
+        return ret
+
+    def close(self):
+        self.fileobj.close()
+
+
+def open_dump(path):
+    if path.endswith('.bz2'):
+        return BZ2MultiStreamFile(open(path, 'rb'))
+    elif path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _local_name(tag, _cache={}):
+    # strips the export schema namespace, e.g., '{http://...}page'
+    try:
+        return _cache[tag]
+    except KeyError:
+        ret = _cache[tag] = tag.rpartition('}')[2]
+        return ret
+
+
+def _to_unicode(text):
+    if text is None:
+        return ''
+    return unicode(text)
+
+
+def iter_dump_revisions(path_or_file, namespaces=None, source=None):
+    """
+    Yields a ``Revision`` for every revision in a MediaWiki XML dump,
+    in dump order. ``path_or_file`` is a path (compression is picked
+    by extension) or a file-like object with the uncompressed XML.
+
+    ``namespaces``, if set, is a collection of namespace numbers
+    (e.g., ``[0]`` for articles only); pages in other namespaces are
+    skipped. ``source`` defaults to the site's base URL, as given in
+    the dump's siteinfo.
+    """
+    if isinstance(path_or_file, basestring):
+        dump_file = open_dump(path_or_file)
+    else:
+        dump_file = path_or_file
+    if namespaces is not None:
+        namespaces = set([int(ns) for ns in namespaces])
+    try:
+        stack = []
+        root = None
+        page = rev = None
+        for event, elem in iterparse(dump_file, events=_EVENTS):
+            tag = _local_name(elem.tag)
+            if event == 'start':
+                if root is None:
+                    root = elem
+                elif tag == 'page':
+                    page = {'ns': 0}  # very old dumps have no <ns>
+                elif tag == 'revision' and page is not None:
+                    rev = {'user': None, 'userid': 0, 'parentid': 0,
+                           'comment': '', 'tags': []}
+                stack.append(tag)
+                continue
+            stack.pop()
+            parent = stack[-1] if stack else None
+            if tag == 'revision' and rev is not None:
+                if namespaces is None or page['ns'] in namespaces:
+                    yield _make_revision(page, rev, source)
+                rev = None
+                elem.clear()
+            elif tag == 'page':
+                page = None
+                root.clear()
+            elif tag == 'siteinfo':
+                if source is None:
+                    base_tag = elem.tag[:-len(tag)] + 'base'
+                    source = _to_unicode(elem.findtext(base_tag))
+                root.clear()
+            elif parent == 'page' and tag in _PAGE_FIELDS:
+                page[_PAGE_FIELDS[tag]] = _to_unicode(elem.text)
+                if tag == 'ns':
+                    page['ns'] = int(page['ns'])
+            elif parent == 'revision' and rev is not None:
+                if tag in _REVISION_FIELDS:
+                    rev[_REVISION_FIELDS[tag]] = _to_unicode(elem.text)
+                    if tag == 'text' and elem.get('bytes'):
+                        rev['size'] = int(elem.get('bytes'))
+            elif parent == 'contributor' and tag in _CONTRIBUTOR_FIELDS:
+                rev[_CONTRIBUTOR_FIELDS[tag]] = _to_unicode(elem.text)
+    finally:
+        if dump_file is not path_or_file:
+            dump_file.close()
+
+
+def _make_revision(page, rev, source):
+    rev_dict = dict(page)
+    rev_dict.update(rev)
+    for field in _INT_FIELDS:
+        if rev_dict.get(field):
+            rev_dict[field] = int(rev_dict[field])
+    if rev_dict['user'] is None:
+        del rev_dict['user']  # deleted contributor, use the model default
+    if 'size' not in rev_dict:
+        rev_dict['size'] = len(rev_dict.get('*', '').encode('utf-8'))
+    return Revision.from_query(rev_dict, source=source, is_parsed=False)
+
+
+class GetDumpRevisions(Operation):
+    """
+    Reads revisions from the MediaWiki XML dump at ``path``. Pass
+    ``namespaces`` (e.g., ``namespaces=[0]``) to only get pages in
+    those namespaces. Resuming from a checkpoint rereads the dump up
+    to the last revision produced, skipping past everything before it.
+    """
+    input_field = PassthroughParam('path')
+    output_type = [Revision]
+    batch_size = DEFAULT_BATCH_SIZE
+
+    def __init__(self, *a, **kw):
+        super(GetDumpRevisions, self).__init__(*a, **kw)
+        self._revisions = None
+        self._consumed = 0  # revisions read so far, for resuming
+
+    def process(self):
+        self._mark_started()
+        if self._revisions is None:
+            revisions = iter_dump_revisions(self.input_param,
+                                            self.kwargs.get('namespaces'))
+            self._revisions = islice(revisions, self._consumed, None)
+        count = min(self.batch_size, self.remaining)
+        batch = list(islice(self._revisions, count))
+        if not batch:
+            raise NoMoreResults()
+        self._consumed += len(batch)
+        return self._update_results(batch)
+
+    def _get_state(self):
+        ret = super(GetDumpRevisions, self)._get_state()
+        ret['consumed'] = self._consumed
+        return ret
+
+    def _set_state(self, state):
+        super(GetDumpRevisions, self)._set_state(state)
+        self._consumed = state['consumed']
+
+
+class GetDumpParsedTemplates(Operation):
+    """
+    Parses the templates out of every page in a MediaWiki XML dump,
+    without touching the API. Takes the same ``namespaces`` option as
+    ``GetDumpRevisions``.
+    """
+    subop_chain = [GetDumpRevisions,
+                   GetParsedTemplates]
+
+    def _enqueue(self, queue, params):
+        # the dump reader is enqueued from Operation.__init__(), so
+        # its queue gets the namespaces right before that
+        namespaces = self.kwargs.get('namespaces')
+        if queue.qid == 1 and namespaces is not None:
+            queue.subop_kwargs['namespaces'] = namespaces
+        super(GetDumpParsedTemplates, self)._enqueue(queue, params)
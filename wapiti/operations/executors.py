@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+    wapiti.operations.executors
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Executors decide how the ready suboperations of an Operation get
+    run. The default, ``SerialExecutor``, runs them one at a time in
+    the calling thread, which is how Wapiti has always worked.
+    ``ThreadExecutor`` and ``GeventExecutor`` run up to
+    ``max_workers`` of them at once, which pays off for recursive
+    operations like ``GetCategoryRecursive``, where most of the
+    wall-clock time is spent waiting on independent API requests.
+    With a concurrent executor, queries that follow continuations
+    also fetch each next page while the current one is being
+    processed (see QueryOperation._process_pipelined()).
+
+    Executors only run the work; the owning Operation still picks
+    tasks in priority order and stores their results one by one, in
+    that same order, so limits and deduplication behave exactly as
+    they do serially.
+
+    Executors are shared by every operation bound to a client, and
+    operations nest (an operation's task may itself be an operation
+    with tasks of its own). To avoid starving nested operations of
+    workers, a task submitted while all workers are busy is simply run
+    in the submitting thread ("caller runs").
+"""
+import sys
+import threading
+from collections import deque
+
+try:
+    import gevent.pool
+    import gevent.event
+except ImportError:
+    gevent = None
+
+
+class Job(object):
+    """
+    The result (or exception) of a function call, possibly still
+    running elsewhere.
+    """
+    def __init__(self, func, args, done_event):
+        self.func = func
+        self.args = args
+        self.result = None
+        self.exc_info = None
+        self._done = done_event
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception:
+            self.exc_info = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def wait(self):
+        self._done.wait()
+
+    def get(self):
+        self.wait()
+        if self.exc_info:
+            exc_type, exc_val, exc_tb = self.exc_info
+            raise exc_type, exc_val, exc_tb
+        return self.result
+
+
+class _DoneEvent(object):
+    # serially-run jobs are always done by the time anyone waits on them
+    def set(self):
+        pass
+
+    def wait(self):
+        pass
+
+
+class Executor(object):
+    is_concurrent = False
+    max_workers = 1
+
+    def submit(self, func, *a):
+        raise NotImplementedError('inheriting classes should return a Job')
+
+    def map(self, func, items):
+        """
+        Calls ``func`` on every item, concurrently where possible, and
+        returns the results in order. The first exception raised (in
+        item order) is reraised, after all calls have finished.
+        """
+        items = list(items)
+        if not items:
+            return []
+        # the caller would sit idle anyway, so it runs the last item
+        jobs = [self.submit(func, item) for item in items[:-1]]
+        last_job = Job(func, (items[-1],), _DoneEvent())
+        last_job.run()
+        jobs.append(last_job)
+        for job in jobs:
+            job.wait()
+        return [job.get() for job in jobs]
+
+    def imap(self, func, items, window=None):
+        """
+        Lazily yields ``func(item)`` for every item, in order, keeping
+        up to ``window`` calls in flight (defaults to ``max_workers``).
+        """
+        window = max(1, int(window or self.max_workers))
+        pending = deque()
+        for item in items:
+            pending.append(self.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def __repr__(self):
+        return '%s(max_workers=%r)' % (self.__class__.__name__,
+                                       self.max_workers)
+
+
+class SerialExecutor(Executor):
+    def submit(self, func, *a):
+        job = Job(func, a, _DoneEvent())
+        job.run()
+        return job
+
+    def __repr__(self):
+        return '%s()' % self.__class__.__name__
+
+
+class ThreadExecutor(Executor):
+    is_concurrent = True
+
+    def __init__(self, max_workers=4):
+        self.max_workers = int(max_workers)
+        if self.max_workers < 1:
+            raise ValueError('expected a positive number of workers')
+        self._slots = threading.Semaphore(self.max_workers)
+
+    def submit(self, func, *a):
+        job = Job(func, a, threading.Event())
+        if not self._slots.acquire(False):
+            job.run()  # caller runs
+            return job
+        thread = threading.Thread(target=self._run_job, args=(job,))
+        thread.daemon = True
+        thread.start()
+        return job
+
+    def _run_job(self, job):
+        try:
+            job.run()
+        finally:
+            self._slots.release()
+
+
+class GeventExecutor(Executor):
+    is_concurrent = True
+
+    def __init__(self, max_workers=10):
+        if gevent is None:
+            raise ImportError('GeventExecutor requires gevent')
+        self.max_workers = int(max_workers)
+        self._pool = gevent.pool.Pool(self.max_workers)
+
+    def submit(self, func, *a):
+        job = Job(func, a, gevent.event.Event())
+        if not self._pool.free_count():
+            job.run()  # caller runs
+            return job
+        self._pool.spawn(job.run)
+        return job
+
+
+DEFAULT_EXECUTOR = SerialExecutor()
@@ -46,9 +46,9 @@ class GetCoordinates(QueryOperation):
         for k, pid_dict in query_resp['pages'].iteritems():
             page_ident = PageIdentifier.from_query(pid_dict,
                                                    source=self.source)
-            for coord in pid_dict['coordinates']:
+            for coord in pid_dict.get('coordinates', []):
                 coord_ident = CoordinateIdentifier(coord, page_ident)
-            ret.append(coord_ident)
+                ret.append(coord_ident)
         return ret
 
 
@@ -16,18 +16,76 @@
 """
 from __future__ import unicode_literals
 
+from calendar import timegm
 from datetime import datetime
 from collections import namedtuple, OrderedDict
 
 
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+TIMESTAMP_CACHE_SIZE = 4096
+_TIMESTAMP_CACHE = {}
+
+
+def _is_mw_timestamp(timestamp):
+    # the fixed ISO 8601 format of the API, e.g., '2013-02-21T21:54:25Z'
+    return (len(timestamp) == 20 and timestamp[19] == 'Z'
+            and timestamp[4] == '-' and timestamp[7] == '-'
+            and timestamp[10] == 'T'
+            and timestamp[13] == ':' and timestamp[16] == ':')
+
+
 def parse_timestamp(timestamp):
-    return datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ')
+    """
+    Parses a MediaWiki timestamp into a (naive, UTC) datetime, much
+    faster than strptime. Recently parsed timestamps are memoized, as
+    many repeat (e.g., protection expiries, edits in the same second).
+    """
+    ret = _TIMESTAMP_CACHE.get(timestamp)
+    if ret is not None:
+        return ret
+    if not _is_mw_timestamp(timestamp):
+        # strptime raises the appropriate ValueError
+        return datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+    ret = datetime(int(timestamp[0:4]), int(timestamp[5:7]),
+                   int(timestamp[8:10]), int(timestamp[11:13]),
+                   int(timestamp[14:16]), int(timestamp[17:19]))
+    if len(_TIMESTAMP_CACHE) >= TIMESTAMP_CACHE_SIZE:
+        _TIMESTAMP_CACHE.clear()  # cheaper than LRU bookkeeping
+    _TIMESTAMP_CACHE[timestamp] = ret
+    return ret
+
+
+def parse_timestamp_epoch(timestamp):
+    """
+    Parses a MediaWiki timestamp (e.g., '2013-02-21T21:54:25Z') into
+    an integer number of seconds since the epoch (UTC).
+    """
+    if not _is_mw_timestamp(timestamp):
+        return timegm(datetime.strptime(timestamp,
+                                        TIMESTAMP_FORMAT).utctimetuple())
+    return timegm((int(timestamp[0:4]), int(timestamp[5:7]),
+                   int(timestamp[8:10]), int(timestamp[11:13]),
+                   int(timestamp[14:16]), int(timestamp[17:19])))
 
 
 NamespaceDescriptor = namedtuple('NamespaceDescriptor', 'id title canonical')
 InterwikiDescriptor = namedtuple('InterwikiDescriptor', 'alias url language')
 
 _MISSING = object()
+_INTERNED = {}
+
+
+def intern_value(value):
+    """
+    Like the builtin ``intern()``, but works on unicode, too. Used for
+    values repeated across many models (e.g., ``source``), so that
+    they share one string. The table is never pruned, so only intern
+    values with few distinct possibilities.
+    """
+    try:
+        return _INTERNED.setdefault(value, value)
+    except TypeError:  # unhashable
+        return value
 
 
 class NamespaceDescriptor(object):
@@ -42,6 +100,7 @@ class WapitiModelAttr(object):
         self.name = name
         self.mw_name = kw.pop('mw_name', name)
         self.display = kw.pop('display', False)
+        self.intern = kw.pop('intern', False)
         try:
             self.type = kw.pop('type')
             if not isinstance(self.type, type):
@@ -66,6 +125,8 @@ class WapitiModelAttr(object):
             ret.extend([', default=', repr(self.default)])
         if self.display:
             ret.extend([', display=', repr(self.display)])
+        if self.intern:
+            ret.extend([', intern=', repr(self.intern)])
         ret.append(')')
         return ''.join(ret)
 
@@ -149,6 +210,13 @@ class WapitiModelMeta(type):
     default value, if allowed. If an attribute does not have a default
     value, and is missing upon instantiation of a model, an exception
     will be raised.
+
+    Models with `use_slots` set (inherited by subclasses) get
+    `__slots__` generated from their `attributes`, to save memory when
+    holding many instances. Any other instance attributes must be
+    declared with `__slots__` in the class body. This only works if
+    every base model is slotted, too; if any isn't, instances get a
+    `__dict__` as usual.
     """
     attributes = []
 
@@ -162,13 +230,83 @@ class WapitiModelMeta(type):
                                  in attrs.get('attributes', [])])
         all_attributes.update(attr_dict)
         attrs['attributes'] = all_attributes.values()
+        use_slots = attrs.get('use_slots')
+        if use_slots is None:
+            use_slots = any([getattr(b, 'use_slots', False) for b in bases])
+        if use_slots and not any(['__dict__' in vars(c) for b in bases
+                                  for c in b.__mro__]):
+            base_names = set([a.name for b in bases
+                              for a in getattr(b, 'attributes', [])])
+            slots = list(attrs.get('__slots__', ()))
+            # attributes may also be properties backed by other slots
+            slots.extend([n for n in all_attributes if n not in base_names
+                          and n not in slots and n not in attrs])
+            attrs['__slots__'] = tuple(slots)
         if 'unique_on' in attrs:
             unique_func = get_unique_func(attrs['unique_on'])
             attrs['unique_key'] = property(unique_func)
         ret = super(WapitiModelMeta, cls).__new__(cls, name, bases, attrs)
+        ret._from_query = None
+        init_owner = [c for c in ret.__mro__ if '__init__' in vars(c)][0]
+        if vars(init_owner).get('_generic_init'):
+            # no custom __init__() to respect, so from_query() can
+            # skip it in favor of a constructor made for this class
+            ret._from_query = staticmethod(make_from_query(ret))
         return ret
 
 
+_FROM_QUERY_TMPL = '''\
+def _from_query(q_dict, kw):
+    self = cls.__new__(cls)
+    q_get, kw_get = q_dict.get, kw.get
+    missing = []
+%s
+    if missing:
+        raise ValueError('missing expected keyword arguments: %%r'
+                         %% missing)
+    self._post_init()
+    return self
+'''
+
+
+def make_from_query(cls):
+    """
+    Generates a from_query() implementation for a model class which
+    maps MediaWiki API result keys straight to attributes, in a single
+    pass, with no intermediate kwargs dict or ``__init__()`` call.
+    """
+    namespace = {'cls': cls, '_MISSING': _MISSING, '_intern': intern_value}
+    lines = []
+    for i, attr in enumerate(cls.attributes):
+        name, mw_name, a_type, default, _ = attr
+        if mw_name is None:
+            lines.append('val = _MISSING')
+        else:
+            lines.extend(['val = q_get(%r, _MISSING)' % mw_name,
+                          'if val is _MISSING:',
+                          '    val = kw_get(%r, _MISSING)' % mw_name])
+        indent = ''
+        if default is _MISSING:
+            lines.extend(['if val is _MISSING:',
+                          '    missing.append(%r)' % name,
+                          'else:'])
+            indent = '    '
+        else:
+            namespace['_default_%d' % i] = default
+            lines.extend(['if val is _MISSING:',
+                          '    val = _default_%d' % i])
+        if a_type is not _MISSING:
+            namespace['_type_%d' % i] = a_type
+            lines.extend([indent + 'if not isinstance(val, _type_%d):' % i,
+                          indent + '    val = _type_%d(val)' % i])
+        if attr.intern:
+            lines.append(indent + 'val = _intern(val)')
+        lines.append(indent + 'self.%s = val' % name)
+    code = _FROM_QUERY_TMPL % '\n'.join(['    ' + line for line in lines])
+    exec compile(code, '<%s._from_query>' % cls.__name__, 'exec') in namespace
+    return namespace['_from_query']
+
+
 class WapitiModelBase(object):
     """
     The more-concrete counterpart of WapitiModelMeta, which primarily
@@ -186,6 +324,7 @@ class WapitiModelBase(object):
     """
 
     __metaclass__ = WapitiModelMeta
+    __slots__ = ()
     attributes = []
     unique_on = lambda self: self
     exists = True # Defaults to True, instances can represent non-existent pages
@@ -202,16 +341,35 @@ class WapitiModelBase(object):
                 val = attr.default
             if attr.type is not _MISSING and not isinstance(val, attr.type):
                 val = attr.type(val)
-                print val
+            if attr.intern:
+                val = intern_value(val)
             setattr(self, attr.name, val)
         if missing:
             raise ValueError('missing expected keyword arguments: %r'
                              % missing)
         # TODO: raise on unexpected keyword arguments?
-        return
+        self._post_init(**kw)
+
+    _generic_init = True  # see WapitiModelMeta
+
+    def _post_init(self, **kw):
+        """
+        Called once all attributes are set, by both ``__init__()``
+        and ``from_query()``, with any leftover keyword arguments
+        (none, from ``from_query()``). Override this, not
+        ``__init__()``, to keep the fast from_query().
+        """
+        pass
 
     @classmethod
     def from_query(cls, q_dict, **kw):
+        if cls._from_query is not None:
+            return cls._from_query(q_dict, kw)
+        return cls._init_from_query(q_dict, kw)
+
+    @classmethod
+    def _init_from_query(cls, q_dict, kw):
+        # the slow path, for models with their own __init__()
         kwargs = {}
         all_q_dict = dict(kw)
         all_q_dict.update(q_dict)
@@ -263,9 +421,10 @@ class PageIdentifier(WapitiModelBase):
     attributes = [WMA('title', display=True),
                   WMA('page_id', mw_name='pageid', display=True, default=None),
                   WMA('ns', display=True),
-                  WMA('source')]
+                  WMA('source', intern=True)]
 
     unique_on = 'title'
+    use_slots = True
 
     @property
     def exists(self):
@@ -304,12 +463,12 @@ class ExternalLink(Link, PageIdentifier):
 
 
 class PageInfo(PageIdentifier):
+    __slots__ = ('req_title',)
     attributes = [WMA('subject_id', mw_name='subjectid', default=None),
                   WMA('talk_id', mw_name='talkid', default=None)]
 
-    def __init__(self, **kw):
-        req_title = kw.pop('req_title', None)
-        super(PageInfo, self).__init__(**kw)
+    def _post_init(self, req_title=None, **kw):
+        super(PageInfo, self)._post_init(**kw)
         self.req_title = req_title or self.title
 
         if self.is_subject_page:
@@ -319,6 +478,12 @@ class PageInfo(PageIdentifier):
         else:
             raise ValueError('special or nonexistent namespace: %r' % self.ns)
 
+    def _get_page_kwargs(self):
+        kwargs = dict([(a.name, getattr(self, a.name))
+                       for a in PageInfo.attributes])
+        kwargs['req_title'] = self.req_title
+        return kwargs
+
     def get_subject_info(self):
         if self.is_subject_page:
             return self
@@ -326,7 +491,7 @@ class PageInfo(PageIdentifier):
             raise ValueError('subject_id not set')
         subj_title = title_talk2subject(self.title)
         subj_ns = self.ns - 1
-        kwargs = dict(self.__dict__)
+        kwargs = self._get_page_kwargs()
         kwargs['title'] = subj_title
         kwargs['ns'] = subj_ns
         return PageInfo(**kwargs)
@@ -338,7 +503,7 @@ class PageInfo(PageIdentifier):
             raise ValueError('talk_id not set')
         talk_title = title_subject2talk(self.title)
         talk_ns = self.ns + 1
-        kwargs = dict(self.__dict__)
+        kwargs = self._get_page_kwargs()
         kwargs['title'] = talk_title
         kwargs['ns'] = talk_ns
         return PageInfo(**kwargs)
@@ -363,16 +528,51 @@ class RevisionInfo(PageInfo):
                   WMA('parsed_comment', mw_name='parsedcomment', default=''),
                   WMA('tags')]
 
+    __slots__ = ('_timestamp',)
     unique_on = 'rev_id'
 
+    # How timestamps are stored, for bulk jobs which rarely read them:
+    #   - 'datetime': parsed when the model is created
+    #   - 'string': kept as is until first accessed
+    #   - 'epoch': seconds since the epoch, converted on every access
+    # e.g., RevisionInfo.timestamp_mode = 'epoch'
+    timestamp_mode = 'datetime'
+
     # note that certain revisions may have hidden the fields
     # user_id, user_text, and comment for administrative reasons,
     # aka "oversighting"
     # TODO: is oversighting better handled in operation?
 
-    def __init__(self, *a, **kw):
-        super(RevisionInfo, self).__init__(*a, **kw)
-        self.timestamp = parse_timestamp(self.timestamp)
+    def _post_init(self, **kw):
+        super(RevisionInfo, self)._post_init(**kw)
+        timestamp = self._timestamp
+        if isinstance(timestamp, basestring):
+            if self.timestamp_mode == 'datetime':
+                self._timestamp = parse_timestamp(timestamp)
+            elif self.timestamp_mode == 'epoch':
+                self._timestamp = parse_timestamp_epoch(timestamp)
+
+    def _get_timestamp(self):
+        timestamp = self._timestamp
+        if isinstance(timestamp, basestring):
+            timestamp = self._timestamp = parse_timestamp(timestamp)
+        elif isinstance(timestamp, (int, long)):
+            timestamp = datetime.utcfromtimestamp(timestamp)
+        return timestamp
+
+    def _set_timestamp(self, timestamp):
+        self._timestamp = timestamp
+
+    timestamp = property(_get_timestamp, _set_timestamp)
+
+    @property
+    def timestamp_epoch(self):
+        timestamp = self._timestamp
+        if isinstance(timestamp, basestring):
+            return parse_timestamp_epoch(timestamp)
+        elif isinstance(timestamp, datetime):
+            return timegm(timestamp.utctimetuple())
+        return timestamp
 
 
 class Revision(RevisionInfo):
@@ -477,10 +677,8 @@ class CoordinateIdentifier(object):
         self.dim = coord.get('dim')
         self.country = coord.get('country')
         self.region = coord.get('region')
-        if coord.get('primary', False):
-            self.primary = True
-        else:
-            self.primary = False
+        # boolean flags come as empty strings, e.g., "primary": ""
+        self.primary = 'primary' in coord
         return
 
 
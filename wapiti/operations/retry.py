@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+    wapiti.operations.retry
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    A ``RetryPolicy`` decides whether a failed MediaWikiCall gets
+    another try, and how long to wait first. One policy is shared by
+    all the operations of a client, so that it can combine these
+    retry strategies:
+
+    - per-request retries: up to ``max_retries`` per call
+    - absolute number of failures: once ``max_failures`` requests have
+      failed, the client stops retrying altogether
+    - streaks of failures: likewise, after ``max_streak`` consecutive
+      failures (e.g., the network or the wiki is down)
+    - fail fast: if the very first request fails, it's most likely a
+      configuration problem (wrong API URL, no network), so don't retry
+    - reduce the query limit on timeouts: with ``shrink_on_timeout``,
+      a timed-out query is retried asking for half as many results,
+      and its operation keeps using the smaller limit
+
+    Retries wait a jittered exponential backoff ("full jitter"), or as
+    long as the server asks via Retry-After, whichever is longer. Only
+    idempotent (GET) requests are ever retried.
+
+    To never retry, pass ``retry_policy=RetryPolicy(max_retries=0)``.
+"""
+from __future__ import unicode_literals
+
+import random
+import socket
+import httplib
+import urllib2
+import threading
+
+RETRYABLE_CODES = (408, 429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('get', 'head')
+
+
+def is_timeout(exc):
+    if isinstance(exc, socket.timeout):
+        return True
+    return (isinstance(exc, urllib2.URLError)
+            and isinstance(getattr(exc, 'reason', None), socket.timeout))
+
+
+def is_retryable(exc):
+    if isinstance(exc, urllib2.HTTPError):
+        return exc.code in RETRYABLE_CODES
+    # ValueError: a truncated or otherwise undecodable JSON response
+    return isinstance(exc, (socket.error, httplib.HTTPException,
+                            urllib2.URLError, ValueError))
+
+
+class RetryPolicy(object):
+    def __init__(self, max_retries=3, max_failures=100, max_streak=10,
+                 fail_fast=True, base_delay=1.0, max_delay=60.0,
+                 shrink_on_timeout=True):
+        self.max_retries = max_retries
+        self.max_failures = max_failures
+        self.max_streak = max_streak
+        self.fail_fast = fail_fast
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.shrink_on_timeout = shrink_on_timeout
+
+        self.failure_count = 0
+        self.success_count = 0
+        self.streak = 0
+        self._lock = threading.Lock()
+
+    def record_success(self):
+        with self._lock:
+            self.success_count += 1
+            self.streak = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failure_count += 1
+            self.streak += 1
+
+    def should_retry(self, exc, attempt, method='get'):
+        """
+        Whether to retry a request which failed with ``exc`` after
+        ``attempt`` retries.
+        """
+        if method.lower() not in IDEMPOTENT_METHODS:
+            return False
+        if attempt >= self.max_retries or not is_retryable(exc):
+            return False
+        with self._lock:
+            if self.fail_fast and not self.success_count:
+                return False
+            if self.max_failures is not None \
+                    and self.failure_count >= self.max_failures:
+                return False
+            if self.max_streak is not None and self.streak >= self.max_streak:
+                return False
+        return True
+
+    def get_delay(self, attempt, exc=None):
+        max_delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = random.uniform(0, max_delay)
+        headers = getattr(exc, 'hdrs', None)
+        if headers is not None:
+            retry_after = headers.getheader('retry-after')
+            if retry_after and retry_after.strip().isdigit():
+                delay = max(delay, int(retry_after))
+        return delay
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return ('<%s max_retries=%r failures=%d streak=%d>'
+                % (cn, self.max_retries, self.failure_count, self.streak))
@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 from base import QueryOperation
 from params import StaticParam, MultiParam, SingleParam
 from models import RevisionInfo, Revision
+from table import RevisionTable
 from utils import OperationExample
 
 DEFAULT_PROPS = 'ids|flags|timestamp|user|userid|size|sha1|comment|parsedcomment|tags'
@@ -18,19 +19,24 @@ class GetPageRevisionInfos(QueryOperation):
     fields = [StaticParam('prop', 'revisions'),
               MultiParam('prop', DEFAULT_PROPS)]
     output_type = [RevisionInfo]
+    table_type = RevisionTable
     examples = [OperationExample('Coffee', 10)]
 
-    def extract_results(self, query_resp):
-        ret = []
+    def iter_result_dicts(self, query_resp):
         pages = [p for p in query_resp.get('pages', {}).values()
                  if 'missing' not in p]
         for pid_dict in pages:
             for rev in pid_dict.get('revisions', []):
-                rev_dict = dict(pid_dict)
-                rev_dict.update(rev)
-                rev_info = RevisionInfo.from_query(rev_dict,
-                                                   source=self.source)
-                ret.append(rev_info)
+                yield rev, pid_dict
+
+    def extract_results(self, query_resp):
+        ret = []
+        for rev, pid_dict in self.iter_result_dicts(query_resp):
+            rev_dict = dict(pid_dict)
+            rev_dict.update(rev)
+            rev_info = RevisionInfo.from_query(rev_dict,
+                                               source=self.source)
+            ret.append(rev_info)
         return ret
 
 
@@ -43,7 +49,7 @@ class GetRevisionInfos(GetPageRevisionInfos):
     examples = [OperationExample(['538903663', '539916351', '531458383'])]
 
     def prepare_params(self, *a, **kw):
-        ret = super(GetRevisionInfos, self).prepare_params()
+        ret = super(GetRevisionInfos, self).prepare_params(*a, **kw)
         ret.pop(self.field_prefix + 'limit', None)
         return ret
 
@@ -61,12 +67,15 @@ class GetCurrentContent(QueryOperation):
     examples = [OperationExample('This page does not exist'),
                 OperationExample('Coffee')]
     output_type = Revision
+    result_keys = ('revisions',)
 
     def extract_results(self, query_resp):
         ret = []
         #redirect_list = query_resp.get('redirects', [])  # TODO
         #redirects = dict([(r['from'], r['to']) for r in redirect_list])
-        requested_title = self.input_param
+        titles = self.input_param_list
+        # with several titles, there's no telling which was requested
+        requested_title = titles[0] if len(titles) == 1 else None
         is_parsed = self.kwargs.get('rvparse', False)
 
         pages = query_resp.get('pages', {})
@@ -78,7 +87,8 @@ class GetCurrentContent(QueryOperation):
             revision = Revision.from_query(rev_dict,
                                            source=self.source,
                                            is_parsed=is_parsed)
-            revision.req_title = requested_title
+            if requested_title:
+                revision.req_title = requested_title
             ret.append(revision)
         return ret
 
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+    wapiti.operations.stats
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Every operation keeps an ``OperationStats``, counting the work
+    done by the operation and all of its suboperations. Counts roll up
+    from each suboperation to its parent operation, and from top-level
+    operations to the client, so ``client.stats`` covers everything
+    the client has done::
+
+        get_cat = client.get_category('Africa', 500)
+        get_cat()
+        print get_cat.stats.to_dict()
+
+    Comparing ``request_time``, ``json_time`` and ``extract_time``
+    tells whether a slow crawl is network-, JSON- or model-bound.
+
+    For a finer-grained view, the client's ``metrics_hooks`` are
+    called with a dict for every request made (``'type': 'request'``)
+    and every operation run to completion (``'type': 'operation'``).
+    ``MetricsFileHook`` appends these records to a file, one JSON
+    object per line.
+"""
+from __future__ import unicode_literals
+
+import json
+import time
+import threading
+from collections import Counter
+
+
+STAT_NAMES = ('ops_executed',    # operations which got processed
+              'subops_skipped',  # duplicate subop params not enqueued
+              'requests',        # web requests made
+              'cache_hits',      # requests served by the response cache
+              'retries',         # requests retried
+              'errors',          # exceptions and API errors
+              'raw_bytes',       # bytes downloaded (usually compressed)
+              'bytes',           # bytes after decompression
+              'request_time',    # seconds waiting on web requests
+              'json_time',       # seconds decoding JSON
+              'extract_time')    # seconds turning responses into results
+
+
+class OperationStats(object):
+    def __init__(self, parent=None):
+        self.parent = parent
+        self._counts = dict([(name, 0) for name in STAT_NAMES])
+        self._servedby = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, servedby=None, **counts):
+        """
+        Adds ``counts`` (keyed by stat name) to this object and all of
+        its parents. ``servedby``, if set, is the name of the server
+        which handled a request.
+        """
+        stats = self
+        while stats is not None:
+            with stats._lock:
+                for name, count in counts.items():
+                    stats._counts[name] += count
+                if servedby:
+                    stats._servedby[servedby] += 1
+            stats = stats.parent
+
+    def __getattr__(self, name):
+        if name in STAT_NAMES:
+            return self._counts[name]
+        raise AttributeError(name)
+
+    @property
+    def servedby(self):
+        with self._lock:
+            return dict(self._servedby)
+
+    @property
+    def kb_downloaded(self):
+        return self.raw_bytes / 1024.0
+
+    def to_dict(self):
+        with self._lock:
+            ret = dict(self._counts)
+            ret['servedby'] = dict(self._servedby)
+        ret['kb_downloaded'] = ret['raw_bytes'] / 1024.0
+        return ret
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return ('<%s ops_executed=%d requests=%d kb_downloaded=%.1f>'
+                % (cn, self.ops_executed, self.requests, self.kb_downloaded))
+
+
+def emit_metrics(client, record):
+    hooks = getattr(client, 'metrics_hooks', None)
+    if not hooks:
+        return
+    record.setdefault('time', time.time())
+    for hook in hooks:
+        hook(record)
+
+
+class MetricsFileHook(object):
+    """
+    A metrics hook which appends each record to ``path`` as a line of
+    JSON. Safe to share between threads.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, sort_keys=True, default=repr)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.path)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+    wapiti.operations.table
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Columnar result sets, for bulk jobs which fetch many results and
+    only want a few of their fields. Operations with a ``table_type``
+    accept ``columnar=True``, and then produce a ``ResultTable``
+    instead of a list of models::
+
+        get_revs = client.get_page_revision_infos('Coffee', 10000,
+                                                  columnar=True)
+        revs = get_revs()
+        big_revs = revs.filter('size', lambda size: size > 50000)
+        print len(big_revs), max(big_revs['timestamp'])
+
+    No per-result model objects are created: integer fields go
+    straight into ``array`` columns, timestamps are stored as integer
+    seconds since the epoch, and repeated strings (titles, user names)
+    are shared within a table. Columnar operations don't deduplicate
+    their results, nor support the ``exists`` filter.
+"""
+from __future__ import unicode_literals
+
+from array import array
+from itertools import compress, izip
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from models import parse_timestamp_epoch
+
+
+INT, TIMESTAMP, STRING = 'int', 'timestamp', 'string'
+INT_TYPECODE = b'l'  # array() wants a native string typecode
+
+TableColumn = namedtuple('TableColumn', 'name mw_name kind default')
+
+_ROW_TYPES = {}
+
+
+def get_row_type(table_type):
+    try:
+        return _ROW_TYPES[table_type]
+    except KeyError:
+        ret = namedtuple(table_type.__name__ + 'Row',
+                         [c.name for c in table_type.columns])
+        _ROW_TYPES[table_type] = ret
+        return ret
+
+
+class ResultTable(object):
+    """
+    A table of results, one column per entry in ``columns``. Each
+    column is filled from a key of the API results, like a model
+    attribute (see models.WapitiModelAttr), and is one of:
+
+    - ``INT``: an ``array`` of integers
+    - ``TIMESTAMP``: an ``array`` of seconds since the epoch
+    - ``STRING``: a list of strings, with equal strings shared
+
+    Columns are accessed by name (``table['size']``), and iterating
+    over the table yields rows as namedtuples.
+    """
+    columns = []
+
+    def __init__(self, source=None):
+        self.source = source
+        self._data = {}
+        for col in self.columns:
+            if col.kind == STRING:
+                self._data[col.name] = []
+            else:
+                self._data[col.name] = array(INT_TYPECODE)
+        self._strings = {}
+
+    def add_query(self, q_dict, defaults=None):
+        """
+        Adds a row from a dictionary from the API, looking up any
+        missing keys in ``defaults`` (e.g., the page of a revision).
+        """
+        defaults = defaults or {}
+        data, strings = self._data, self._strings
+        for name, mw_name, kind, default in self.columns:
+            try:
+                val = q_dict[mw_name]
+            except KeyError:
+                val = defaults.get(mw_name, default)
+            if kind == STRING:
+                val = strings.setdefault(val, val)
+            elif kind == TIMESTAMP:
+                val = parse_timestamp_epoch(val) if val else 0
+            data[name].append(val)
+
+    def extend(self, other):
+        strings = self._strings
+        for col in self.columns:
+            if col.kind == STRING:
+                self._data[col.name].extend([strings.setdefault(v, v)
+                                             for v in other[col.name]])
+            else:
+                self._data[col.name].extend(other[col.name])
+
+    def truncate(self, size):
+        for column in self._data.values():
+            del column[size:]
+
+    def mask(self, name, predicate):
+        """
+        Returns a list of booleans, one per row, of ``predicate``
+        called on each value of column ``name``. Masks combine as
+        usual, e.g., ``[a and b for a, b in zip(mask1, mask2)]``.
+        """
+        return [bool(predicate(val)) for val in self._data[name]]
+
+    def compress(self, mask):
+        """
+        Returns a new table of the rows for which ``mask`` is true.
+        """
+        ret = self.__class__(source=self.source)
+        ret._strings = self._strings
+        for name, column in self._data.items():
+            selected = compress(column, mask)
+            if isinstance(column, array):
+                ret._data[name] = array(column.typecode, selected)
+            else:
+                ret._data[name] = list(selected)
+        return ret
+
+    def filter(self, name, predicate):
+        return self.compress(self.mask(name, predicate))
+
+    def to_numpy(self):
+        """
+        Returns a dict of column name to NumPy array. Integer columns
+        share memory with the table.
+        """
+        if numpy is None:
+            raise ImportError('ResultTable.to_numpy() requires numpy')
+        ret = {}
+        for name, column in self._data.items():
+            if isinstance(column, array):
+                ret[name] = numpy.frombuffer(column, dtype=column.typecode)
+            else:
+                ret[name] = numpy.array(column, dtype=object)
+        return ret
+
+    def to_dict(self):
+        return dict([(name, list(column))
+                     for name, column in self._data.items()])
+
+    def __getitem__(self, name):
+        return self._data[name]
+
+    def __len__(self):
+        return len(self._data[self.columns[0].name])
+
+    def __iter__(self):
+        row_type = get_row_type(type(self))
+        columns = [self._data[c.name] for c in self.columns]
+        for values in izip(*columns):
+            yield row_type(*values)
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return '<%s rows=%d source=%r>' % (cn, len(self), self.source)
+
+
+class RevisionTable(ResultTable):
+    """
+    The columnar counterpart of models.RevisionInfo.
+    """
+    columns = [TableColumn('rev_id', 'revid', INT, 0),
+               TableColumn('parent_rev_id', 'parentid', INT, 0),
+               TableColumn('page_id', 'pageid', INT, 0),
+               TableColumn('ns', 'ns', INT, 0),
+               TableColumn('title', 'title', STRING, ''),
+               TableColumn('size', 'size', INT, 0),
+               TableColumn('user_id', 'userid', INT, -1),
+               TableColumn('user_text', 'user', STRING, '!userhidden'),
+               TableColumn('timestamp', 'timestamp', TIMESTAMP, None)]
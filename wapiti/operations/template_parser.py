@@ -25,7 +25,11 @@ TODO
 from __future__ import unicode_literals
 
 import re
+import types
+import inspect
 import itertools
+import threading
+import multiprocessing
 """
 Notes
 -----
@@ -70,6 +74,10 @@ class TemplateReference(object):
         cn = self.__class__.__name__
         return '%s(%r, %r, %r)' % (cn, self.name, self.args, self.kwargs)
 
+    def __reduce__(self):
+        # compact pickles, for shipping results back from a ParsePool
+        return (self.__class__, (self.name, self.args, self.kwargs))
+
     def __getitem__(self, key):
         try:
             return self.kwargs[key]
@@ -80,20 +88,111 @@ class TemplateReference(object):
         return itertools.chain(iter(self.args), self.kwargs.iteritems())
 
 
-def get_page_templates(source, raise_exc=True):
-    tokens = tokenize(source)
-    parsed = parse(tokens, raise_exc=raise_exc)
-    return [t for t in parsed if isinstance(t, TemplateReference)]
+def get_page_templates(source, raise_exc=True, names=None):
+    return list(iter_page_templates(source, raise_exc=raise_exc, names=names))
+
+
+def iter_page_templates(source, raise_exc=True, names=None):
+    """
+    Lazily yields the top-level templates of ``source``, each as soon
+    as its closing ``}}`` is seen. Tokens are produced on demand and
+    text outside of templates is skipped, so memory use depends on the
+    size of the templates, not the page.
+
+    If ``names`` is set, only templates with one of those names are
+    parsed (along with any templates nested inside them). The results
+    are the same as filtering those of a full parse by name: only
+    top-level templates, not those inside other templates, links,
+    tables or comments. Everything else is only scanned for template
+    nesting, without being tokenized or parsed. Names compare as
+    MediaWiki compares them, more or less: case-insensitively, and
+    with underscores the same as spaces.
+    """
+    if names:
+        return _iter_named_templates(source, names, raise_exc)
+    tokens = get_tokenizer().iter_tokens(source)
+    return iter_parse(tokens, raise_exc=raise_exc, keep_text=False)
+
+
+def normalize_template_name(name):
+    name = ' '.join(unicode(name).replace('_', ' ').split()).lower()
+    if name.startswith('template:'):
+        name = name[len('template:'):].lstrip()
+    return name
+
+
+def _get_name_re(names):
+    name_pats = [re.escape(' '.join(n.replace('_', ' ').split()))
+                 for n in names]
+    name_pats = [np.replace('\\ ', '[ _]+') for np in name_pats]
+    return re.compile(r'\{\{\s*(?:template\s*:\s*)?(?:%s)\s*(?=\||\}\}|<!--)'
+                      % '|'.join(name_pats), re.IGNORECASE | re.UNICODE)
+
+
+def _find_top_level(scanner, name_re, source, pos):
+    # follows template nesting as iter_parse() would, with the spans
+    # the tokenizer keeps whole (links, tables, comments, etc.) being
+    # skipped, but without making any tokens
+    depth = 0
+    for match in scanner.finditer(source, pos):
+        start, end = match.span()
+        if end - start != 2:
+            continue  # not a '{{' or '}}'
+        if source[start] == '}':
+            depth = max(0, depth - 1)
+        elif depth == 0 and name_re.match(source, start):
+            return start
+        else:
+            depth += 1
+    return None
+
+
+def _iter_named_templates(source, names, raise_exc=True):
+    names = [normalize_template_name(n) for n in names]
+    name_set = set(names)
+    name_re = _get_name_re(names)
+    if name_re.search(source) is None:
+        return
+    tokenizer = get_tokenizer()
+    pos = 0
+    while True:
+        start = _find_top_level(tokenizer.scanner, name_re, source, pos)
+        if start is None:
+            return
+        last_token = [None]
+
+        def tokens():
+            for token in tokenizer.iter_tokens(source, start):
+                last_token[0] = token
+                yield token
+        parsed = iter_parse(tokens(), raise_exc=raise_exc, keep_text=False)
+        tmpl = next(parsed, None)
+        if tmpl is None:
+            return  # unclosed, the rest of the page is inside it
+        if normalize_template_name(tmpl.name) in name_set:
+            yield tmpl
+        pos = last_token[0].end_index
 
 
 class Token(object):
-    def __init__(self, start_index, text):
+    """
+    A span of the source text. The text itself is only sliced out when
+    needed, so tokens which get skipped (e.g., comments) cost no copy.
+    """
+    __slots__ = ('source', 'start_index', 'end_index')
+
+    def __init__(self, source, start_index, end_index):
+        self.source = source
         self.start_index = start_index
-        self.text = text
+        self.end_index = end_index
+
+    @property
+    def text(self):
+        return self.source[self.start_index:self.end_index]
 
     @classmethod
     def from_match(cls, match):
-        return cls(start_index=match.start(), text=match.group())
+        return cls(match.string, match.start(), match.end())
 
     def __repr__(self):
         cn = self.__class__.__name__
@@ -101,47 +200,47 @@ class Token(object):
 
 
 class BufferToken(Token):
-    pass
+    __slots__ = ()
 
 
 class CommentToken(BufferToken):
-    pass
+    __slots__ = ()
 
 
 class LinkToken(BufferToken):
-    pass
+    __slots__ = ()
 
 
 class TableToken(BufferToken):
-    pass
+    __slots__ = ()
 
 
 class TemplateLogicToken(BufferToken):
-    pass
+    __slots__ = ()
 
 
 class SepToken(Token):
-    pass
+    __slots__ = ()
 
 
 class StartTemplateToken(Token):
-    pass
+    __slots__ = ()
 
 
 class EndTemplateToken(SepToken):
-    pass
+    __slots__ = ()
 
 
 LEXICON = \
-    [(r'(\[\[.+?\]\])', lambda m, t: LinkToken.from_match(m)),
-     (r'(\{\|.+?\|\})', lambda m, t: TableToken.from_match(m)),
-     (r'(\{\{\{.+?\}\}\})', lambda m, t: TemplateLogicToken.from_match(m)),
-     (r'(\{\{#.+?\|\}\})', lambda m, t: TemplateLogicToken.from_match(m)),
-     (r'(<!--.+?-->)', lambda m, t: CommentToken.from_match(m)),
-     (r'\{\{', lambda m, t: StartTemplateToken.from_match(m)),
-     (r'\}\}', lambda m, t: EndTemplateToken.from_match(m)),
-     (r'=', lambda m, t: SepToken.from_match(m)),
-     (r'\|', lambda m, t: SepToken.from_match(m))]
+    [(r'(\[\[.+?\]\])', lambda m: LinkToken.from_match(m)),
+     (r'(\{\|.+?\|\})', lambda m: TableToken.from_match(m)),
+     (r'(\{\{\{.+?\}\}\})', lambda m: TemplateLogicToken.from_match(m)),
+     (r'(\{\{#.+?\|\}\})', lambda m: TemplateLogicToken.from_match(m)),
+     (r'(<!--.+?-->)', lambda m: CommentToken.from_match(m)),
+     (r'\{\{', lambda m: StartTemplateToken.from_match(m)),
+     (r'\}\}', lambda m: EndTemplateToken.from_match(m)),
+     (r'=', lambda m: SepToken.from_match(m)),
+     (r'\|', lambda m: SepToken.from_match(m))]
 
 
 def build_scanner(lexicon, flags=0):
@@ -162,26 +261,91 @@ def build_scanner(lexicon, flags=0):
     return scanner
 
 
-def tokenize(source, lexicon=None):
+def _takes_text(action):
+    # whether a lexicon callback has the (match, text) signature
+    func = action
+    if not isinstance(func, (types.FunctionType, types.MethodType)):
+        func = getattr(func, '__call__', func)
+    try:
+        args, varargs = inspect.getargspec(func)[:2]
+    except TypeError:
+        return True  # e.g., builtins, which can't be inspected
+    if isinstance(func, types.MethodType) and func.im_self is not None:
+        args = args[1:]
+    return bool(varargs) or len(args) > 1
+
+
+def _with_text(action):
+    return lambda match: action(match, match.group())
+
+
+class Tokenizer(object):
+    """
+    Splits wikitext into tokens according to a lexicon, a list of
+    (pattern, callback) pairs. Each callback returns a token for a
+    match. Callbacks taking only the match object leave the matched
+    text in the source until the token needs it (see Token.text);
+    those taking ``(match, text)`` also get a copy of the text, as
+    they always have. Compiling the lexicon's patterns into a single
+    scanner is far more expensive than tokenizing a typical page, so
+    a Tokenizer does it once, up front, and can be reused for any
+    number of pages. Custom lexicons can be pre-built with
+    ``Tokenizer(my_lexicon)``, or fetched from the module-level cache
+    with ``get_tokenizer(my_lexicon)``.
+    """
+    def __init__(self, lexicon=None, flags=re.DOTALL):
+        self.lexicon = list(lexicon or LEXICON)
+        self.flags = flags
+        self.actions = []
+        for _, action in self.lexicon:
+            if not callable(action):
+                raise TypeError('expected callable callback, not %r'
+                                % (action,))
+            if _takes_text(action):
+                action = _with_text(action)
+            self.actions.append(action)
+        self.scanner = build_scanner(self.lexicon, flags)
+
+    def tokenize(self, source):
+        return list(self.iter_tokens(source))
+
+    def iter_tokens(self, source, pos=0):
+        actions = self.actions
+        start, end, prev_end = pos, pos, pos
+        for match in self.scanner.finditer(source, pos):
+            start, end = match.start(), match.end()
+            if prev_end < start:
+                yield BufferToken(source, prev_end, start)
+            yield actions[match.lastindex - 1](match)
+            prev_end = end
+        if prev_end < len(source):
+            yield BufferToken(source, prev_end, len(source))
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return '<%s (%d rules)>' % (cn, len(self.lexicon))
+
+
+_TOKENIZER_CACHE = {}
+
+
+def get_tokenizer(lexicon=None, flags=re.DOTALL):
+    """
+    Returns a Tokenizer for the lexicon, built on first request and
+    memoized per (lexicon, flags). Lexicons are few and small, so the
+    cache is never pruned.
+    """
     lexicon = lexicon or LEXICON
-    lex = build_scanner(lexicon, re.DOTALL)
-    all_tokens = []
-    start, end, prev_end = 0, 0, 0
-    for match in lex.finditer(source):
-        start, end = match.start(), match.end()
-        if prev_end < start:
-            all_tokens.append(BufferToken(start, source[prev_end:start]))
-        action = lexicon[match.lastindex - 1][1]
-        if callable(action):
-            # TODO: what should the callbacks want?
-            cur_token = action(match, match.group())
-            all_tokens.append(cur_token)
-        else:
-            raise TypeError('expected callable callback, not %r' % (action,))
-        prev_end = end
-    if prev_end < len(source):
-        all_tokens.append(BufferToken(prev_end, source[prev_end:]))
-    return all_tokens
+    key = (tuple([tuple(rule) for rule in lexicon]), flags)
+    try:
+        return _TOKENIZER_CACHE[key]
+    except KeyError:
+        ret = _TOKENIZER_CACHE[key] = Tokenizer(lexicon, flags)
+        return ret
+
+
+def tokenize(source, lexicon=None):
+    return get_tokenizer(lexicon).tokenize(source)
 
 
 def cond_join(items, sep='', cond=None):
@@ -251,7 +415,15 @@ class ProtoTemplateRef(object):
 
 
 def parse(tokens, raise_exc=True):
-    ret = []
+    return list(iter_parse(tokens, raise_exc=raise_exc))
+
+
+def iter_parse(tokens, raise_exc=True, keep_text=True):
+    """
+    Lazily yields top-level TemplateReferences (and, if
+    ``keep_text``, the text between them) from an iterable of tokens.
+    Only the stack of currently-open templates is kept in memory.
+    """
     pts = []  # ProtoTemplate stack
     interstish = []
     for token in tokens:
@@ -259,12 +431,13 @@ def parse(tokens, raise_exc=True):
             continue  # TODO: save comments?
         if isinstance(token, StartTemplateToken):
             if interstish:
-                ret.append(''.join(interstish))
+                yield ''.join(interstish)
                 interstish = []
             pts.append(ProtoTemplateRef(token))
             continue
         elif not pts:
-            interstish.append(token.text)
+            if keep_text:
+                interstish.append(token.text)
             continue
         else:
             cpt = pts[-1]
@@ -309,10 +482,64 @@ def parse(tokens, raise_exc=True):
             if pts:
                 pts[-1].cur_val.append(comp_tmpl)
             else:
-                ret.append(comp_tmpl)
+                yield comp_tmpl
         # end loop
 
-    return ret
+
+def _parse_in_worker(args):
+    source, raise_exc, names = args
+    return get_page_templates(source, raise_exc=raise_exc, names=names)
+
+
+class ParsePool(object):
+    """
+    Parses pages in a pool of worker processes, so that parsing can
+    use all the cores while the crawl goes on fetching. Set it as the
+    client's ``parse_pool`` and GetParsedTemplates will use it, e.g.:
+
+        client = WapitiClient('you@example.com',
+                              executor=ThreadExecutor(8),
+                              parse_pool=ParsePool())
+
+    Calls block until their page is parsed, so use a concurrent
+    executor to keep several pages parsing at once. At most
+    ``max_pending`` pages are queued for (or being parsed by) the
+    workers at a time; more calls wait their turn, so that a fast
+    crawl can't pile up an unbounded backlog of content in memory.
+    The worker processes are started on first use.
+    """
+    def __init__(self, processes=None, max_pending=None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.max_pending = max_pending or 2 * self.processes
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.processes)
+            return self._pool
+
+    def get_page_templates(self, source, raise_exc=True, names=None):
+        pool = self._get_pool()
+        with self._slots:
+            async_res = pool.apply_async(_parse_in_worker,
+                                         ((source, raise_exc, names),))
+            # a timeout keeps the wait interruptible (py2 quirk)
+            return async_res.get(timeout=24 * 60 * 60)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return '%s(processes=%r, max_pending=%r)' % (cn, self.processes,
+                                                     self.max_pending)
 
 
 _BASIC_CITE_TEST = '''{{cite web
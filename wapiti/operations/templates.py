@@ -9,7 +9,8 @@ from params import SingleParam, StaticParam, MultiParam, PassthroughParam
 from models import PageInfo
 from utils import OperationExample
 from revisions import GetCurrentContent
-from template_parser import get_page_templates, TemplateReference, _BASIC_CITE_TEST
+import template_parser
+from template_parser import TemplateReference, _BASIC_CITE_TEST
 
 
 class GetTemplates(QueryOperation):
@@ -49,6 +50,12 @@ class GetTranscludes(QueryOperation):
 
 
 class GetParsedTemplates(Operation):
+    '''
+    Pass ``names`` to only parse templates with those names (and the
+    templates nested inside them), which is much faster when looking
+    for one template in many pages. If the client has a ``parse_pool``
+    (see template_parser.ParsePool), parsing happens there.
+    '''
     input_field = PassthroughParam('content')
     output_type = [TemplateReference]
     examples = [OperationExample(_BASIC_CITE_TEST, limit=1)]
@@ -63,7 +70,11 @@ class GetParsedTemplates(Operation):
         if None in self.results:
             raise NoMoreResults()
         content = getattr(self.input_param, 'content', self.input_param)
-        res = get_page_templates(content, raise_exc=False)
+        parse_pool = getattr(self.client, 'parse_pool', None)
+        if parse_pool is None:
+            parse_pool = template_parser
+        res = parse_pool.get_page_templates(content, raise_exc=False,
+                                            names=self.kwargs.get('names'))
         self.results[None] = res
         return list(res)
 
@@ -84,11 +95,11 @@ class GetParsedTranscludes(Operation):
                    GetParsedTemplates]
     examples = [OperationExample('ArticleHistory', 10)]
 
-    def _update_results(self, results):
+    def __init__(self, *a, **kw):
+        super(GetParsedTranscludes, self).__init__(*a, **kw)
+        # only the transcluded template is parsed out of each page
         _, _, tmpl_name = self.input_param.rpartition(':')
-        filt_res = [res for res in results
-                    if res.name.lower() == tmpl_name.lower()]
-        return super(GetParsedTranscludes, self)._update_results(filt_res)
+        self.subop_queues[-1].subop_kwargs['names'] = [tmpl_name]
 
 
 def tmpl_text_to_odict(text):
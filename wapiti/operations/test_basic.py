@@ -1,14 +1,41 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import os
+import json
+import time
+import socket
+import httplib
+from urlparse import urlparse, parse_qsl
+
 import base
+import ransom
 
-from misc import GetPageInfo
+from misc import GetPageInfo, GetCoordinates
+from protection import GetProtections
+from links import GetLanguageLinks
+from batch import BatchQuery, is_batchable
 from models import PageIdentifier
-from category import GetSubcategoryInfos
+from category import (GetSubcategoryInfos,
+                      GetCategory,
+                      GetCategoryRecursive)
 
 from revisions import GetCurrentContent, GetPageRevisionInfos
 from meta import GetSourceInfo
+from templates import (GetTranscludes,
+                       GetParsedTemplates,
+                       GetParsedTemplatesPage,
+                       GetParsedTranscludes)
+from template_parser import (ParsePool,
+                             Tokenizer,
+                             get_page_templates,
+                             _SF_INFOBOX)
+from executors import ThreadExecutor
+from dedupe import ExactKeyStore, CompactKeyStore, BloomKeyStore
+from cache import ResponseCache, SiteInfoCache, get_cache_key
+from stats import OperationStats
+from retry import RetryPolicy
+from utils import PriorityQueue, chunked_iter
 
 
 def test_unicode_title():
@@ -22,6 +49,13 @@ def test_coercion_basic():
     assert get_subcats.input_param == 'Category:Africa'
 
 
+def test_iter_results():
+    get_featured = GetCategory('Featured_articles', 600)
+    results = list(get_featured.iter_results())
+    assert len(results) == 600
+    assert len(get_featured.results) == 600  # only keys are kept
+
+
 def test_web_request():
     url = 'http://upload.wikimedia.org/wikipedia/commons/d/d2/Mcgregor.jpg'
     get_photo = base.WebRequestOperation(url)
@@ -63,3 +97,817 @@ def test_client_passed_to_subops():
     client = base.MockClient()
     op = GetPageInfo(titles, client=client)
     assert id(op.subop_queues[0].peek().client) == id(client)
+
+
+def test_thread_executor():
+    executor = ThreadExecutor(2)
+
+    def nested(x):
+        # more nested tasks than workers must not deadlock
+        return sum(executor.map(lambda y: x * y, range(4)))
+    assert executor.map(nested, range(5)) == [x * 6 for x in range(5)]
+    assert list(executor.imap(nested, range(5), 3)) == [x * 6 for x in range(5)]
+
+    def fail(x):
+        if x == 3:
+            raise ValueError(x)
+        return x
+    try:
+        executor.map(fail, range(5))
+    except ValueError as ve:
+        assert ve.args == (3,)
+    else:
+        assert False, 'expected ValueError'
+
+
+def test_priority_queue():
+    pq = PriorityQueue()
+    for i in range(1000):
+        pq.add(i, priority=i % 3)
+    assert pq.peek_many(4) == [2, 5, 8, 11]
+    assert pq.peek_many(4) == [2, 5, 8, 11]  # nothing was removed
+    drained = []
+    while pq:
+        task = pq.peek_many(1)[0]
+        drained.append(task)
+        pq.remove(task)
+    assert drained[:3] == [2, 5, 8] and len(drained) == 1000
+    assert pq._pq == []  # no removed entries left behind
+
+
+def test_key_stores():
+    keys = [0, 12, 12, 2 ** 20 + 5, 'Coffee', 'Beyoncé Knowles', ('a', 1)]
+    for store in (ExactKeyStore(), CompactKeyStore(), BloomKeyStore(100)):
+        for key in keys:
+            store.add(key)
+        assert len(store) == 6
+        assert all([key in store for key in keys])
+        assert 13 not in store and 'Tea' not in store
+
+
+def test_response_cache(tmpdir):
+    api_url = 'https://en.wikipedia.org/w/api.php'
+    cache = ResponseCache(str(tmpdir.join('responses.db')),
+                          ttls={'parse': 0}, max_size=2048)
+    params = {'action': 'query', 'list': 'categorymembers',
+              'cmtitle': 'Category:Africa', 'cmcontinue': None}
+    assert cache.get(api_url, params) is None
+    cache.set(api_url, params, b'{"query": {}}')
+    # blank params and URL case don't change the key
+    assert cache.get(api_url.upper().replace('/W/API.PHP', '/w/api.php'),
+                     dict(params, cmcontinue='')) == b'{"query": {}}'
+    assert (cache.hits, cache.misses) == (1, 1)
+    # lists are sent as repeated parameters, not joined
+    assert get_cache_key(api_url, {'titles': ['A', 'B']}) != \
+        get_cache_key(api_url, {'titles': 'A|B'})
+    assert get_cache_key(api_url, {'titles': ['A', 'B']}) != \
+        get_cache_key(api_url, {'titles': ['B', 'A']})
+
+    cache.set(api_url, {'action': 'parse', 'page': 'Africa'}, b'{}')
+    assert len(cache) == 1
+
+    rev_params = {'action': 'query', 'prop': 'revisions', 'revids': '123'}
+    assert cache.get_ttl(rev_params) is None
+    for i in range(10):  # ~1kB each, incompressible
+        cache.set(api_url, {'action': 'query', 'titles': str(i)},
+                  bytes(bytearray(os.urandom(1024))))
+    assert cache.stats['size'] <= 2048
+    assert cache.get(api_url, params) is None  # least recently used
+
+
+def test_stats_rollup():
+    client_stats = OperationStats()
+    op_stats = OperationStats(parent=client_stats)
+    subop_stats = OperationStats(parent=op_stats)
+    subop_stats.add(requests=1, raw_bytes=2048, servedby='mw1')
+    op_stats.add(extract_time=0.5)
+    assert subop_stats.requests == op_stats.requests == 1
+    assert client_stats.kb_downloaded == 2.0
+    assert client_stats.to_dict()['servedby'] == {'mw1': 1}
+    assert client_stats.extract_time == 0.5 and not subop_stats.extract_time
+
+
+def test_rate_limiter():
+    limiter = ransom.RateLimiter(rate=100, burst=2, max_rate=101,
+                                 increase=0.5)
+    assert limiter.acquire() == 0 and limiter.acquire() == 0
+    assert limiter.acquire() > 0  # bucket's empty
+    limiter.record(0.1)
+    limiter.record(0.1)
+    assert limiter.rate == 101
+    limiter.record(0.1, 503)
+    limiter.record(5.0)  # slow, but decreases are once a second
+    assert limiter.rate == 50.5
+    assert ransom.parse_retry_after('120') == 120
+    assert ransom.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+
+
+class StubResponse(object):
+    def __init__(self, status, body='', headers=None):
+        self.status = status
+        self.reason = 'Stub'
+        self.msg = dict(headers or {})
+        self.will_close = False
+        self._body = body
+
+    def getheader(self, name, default=None):
+        return self.msg.get(name.lower(), default)
+
+    def read(self):
+        return self._body
+
+
+class StubConnection(object):
+    """
+    Stands in for an httplib connection, answering from ``routes``, a
+    dict of (host, path) to StubResponse. A ``stale`` connection fails
+    like a keep-alive socket the server already closed.
+    """
+    def __init__(self, netloc, routes):
+        self.netloc = netloc
+        self.routes = routes
+        self.requests = []
+        self.stale = False
+        self.closed = False
+
+    def request(self, method, path, headers=None):
+        self.requests.append((method, path))
+
+    def getresponse(self):
+        if self.stale:
+            raise httplib.BadStatusLine('')
+        path = self.requests[-1][1].split('?')[0]
+        return self.routes[(self.netloc, path)]
+
+    def close(self):
+        self.closed = True
+
+
+class StubConnectionPool(ransom.ConnectionPool):
+    def __init__(self, routes, **kw):
+        super(StubConnectionPool, self).__init__(**kw)
+        self.routes = routes
+        self.connections = []
+
+    def _connect(self, scheme, netloc):
+        ret = StubConnection(netloc, self.routes)
+        self.connections.append(ret)
+        return ret
+
+
+class StubAPIClient(ransom.Client):
+    """
+    Stands in for the web client, answering each API request with the
+    response added for its parameters, as they are sent. Requests
+    without one fail with a KeyError.
+    """
+    def __init__(self, **kw):
+        super(StubAPIClient, self).__init__(**kw)
+        self.responses = {}
+        self.requests = []
+
+    def add(self, params, resp):
+        params = dict(base.BASE_API_PARAMS, **params)
+        query = ransom.encode_url_params(params, base.KEEP_BLANK_PARAMS)
+        self.responses[self._get_key(query)] = json.dumps(resp)
+
+    def _get_key(self, query):
+        return tuple(sorted(parse_qsl(query, keep_blank_values=True)))
+
+    def _send(self, method, url, headers):
+        key = self._get_key(urlparse(url).query)
+        self.requests.append(dict(key))
+        resp_text = self.responses[key]
+        return StubResponse(200, resp_text), resp_text, 0
+
+
+def make_stub_client():
+    # requests go to client.web_client, a StubAPIClient, concurrently
+    ret = base.MockClient()
+    ret.executor = ThreadExecutor(2)
+    ret.web_client = StubAPIClient()
+    return ret
+
+
+def test_connection_pool():
+    routes = {('a.org', '/w/api.php'): StubResponse(200, 'ok'),
+              ('a.org', '/old'): StubResponse(301, headers={
+                  'location': 'http://b.org/new'}),
+              ('b.org', '/new'): StubResponse(200, 'moved')}
+    client = ransom.Client()
+    client.pool = pool = StubConnectionPool(routes, idle_timeout=30)
+    url = 'http://a.org/w/api.php'
+    for _ in range(3):
+        assert client.get(url, {'action': 'query'}).text == 'ok'
+    assert len(pool.connections) == 1  # reused
+    assert len(pool.connections[0].requests) == 3
+
+    idle = pool._idle[('http', 'a.org')]
+    conn, _ = idle.pop()
+    idle.append((conn, time.time() - 60))  # past the idle timeout
+    assert client.get(url).text == 'ok'
+    assert conn.closed and len(pool.connections) == 2
+
+    pool.connections[-1].stale = True
+    resp = client.get(url)
+    assert resp.text == 'ok' and resp.retries == 1
+    assert pool.connections[1].closed and len(pool.connections) == 3
+
+    resp = client.get('http://a.org/old')
+    assert resp.url == 'http://b.org/new' and resp.text == 'moved'
+    assert [c.netloc for c in pool.connections] == ['a.org'] * 3 + ['b.org']
+    assert len(pool) == 2  # one idle connection per host
+
+
+def test_retry_policy():
+    policy = RetryPolicy(max_retries=2, max_streak=3)
+    timeout = socket.timeout('timed out')
+    policy.record_failure()
+    assert not policy.should_retry(timeout, 0)  # fail fast
+    policy.record_success()
+    assert policy.should_retry(timeout, 1)
+    assert not policy.should_retry(timeout, 2)
+    assert not policy.should_retry(timeout, 0, 'post')
+    assert not policy.should_retry(KeyError('title'), 0)
+    for i in range(3):
+        policy.record_failure()
+    assert not policy.should_retry(timeout, 0)  # streak
+    assert 0 <= policy.get_delay(3) <= 8.0
+
+
+def test_checkpoint(tmpdir):
+    path = str(tmpdir.join('checkpoint.gz'))
+    get_cat_rec = GetCategoryRecursive('Africa', 100)
+    get_cat_rec.checkpoint(path)
+    resumed = base.Operation.resume(path)
+    assert type(resumed) is GetCategoryRecursive
+    assert resumed.input_param == 'Category:Africa' and resumed.limit == 100
+    assert [len(q) for q in resumed.subop_queues] == \
+        [len(q) for q in get_cat_rec.subop_queues]
+
+    get_cat = GetCategory('Africa')
+    get_cat.cont_strs.append({'gcmcontinue': 'page|4e4f|123'})
+    get_cat.checkpoint(path)
+    resumed = GetCategory.resume(path)
+    assert resumed.limit is base.ALL
+    assert resumed.last_cont_str == {'gcmcontinue': 'page|4e4f|123'}
+
+    state = get_cat._get_state()  # as saved by older versions
+    state.update(cont_strs=['page|4e4f|123'], cont_str_key='gcmcontinue')
+    get_cat._set_state(state)
+    assert get_cat.last_cont_str == {'gcmcontinue': 'page|4e4f|123'}
+
+
+def test_maxlag_opt_in():
+    from client import WapitiClient
+    client = WapitiClient('test@example.com')
+    assert client.web_client.rate_limiter is None
+    assert client.maxlag is None
+    client = WapitiClient('test@example.com', rate_limiter=True, maxlag=5)
+    assert client.web_client.rate_limiter is not None
+    assert client.maxlag == 5
+
+    client = make_stub_client()
+    api = client.web_client
+    api.add({'action': 'query'}, {'query': {}})
+    api.add({'action': 'query', 'maxlag': 5}, {'query': {}})
+    base.MediaWikiCall({'action': 'query'}, client=client).process()
+    assert 'maxlag' not in api.requests[-1]
+    client.maxlag = 5
+    base.MediaWikiCall({'action': 'query'}, client=client).process()
+    assert api.requests[-1]['maxlag'] == '5'
+
+
+def make_call(params, results):
+    ret = base.MediaWikiCall(params, client=base.DEFAULT_CLIENT)  # unsent
+    ret.results = results
+    return ret
+
+
+def test_continue_protocol():
+    get_cat = GetCategory('Africa')
+    params = get_cat.prepare_params()
+    assert params['continue'] == ''
+    url = ransom.construct_url('http://example.com/w/api.php', params,
+                               base.KEEP_BLANK_PARAMS)
+    assert 'continue=&' in url or url.endswith('continue=')
+
+    cont = {'gcmcontinue': 'page|4e4f|123', 'rvcontinue': '456',
+            'continue': 'gcmcontinue||'}
+    resp = make_call(params, {'continue': cont})
+    assert get_cat.get_cont_str(resp) == cont
+    resp = make_call(params, {'batchcomplete': ''})
+    assert get_cat.get_cont_str(resp) is None
+    legacy = {'query-continue': {'categorymembers': {'gcmcontinue': 'p|1'},
+                                 'revisions': {'rvcontinue': '456'}}}
+    resp = make_call(params, legacy)
+    assert get_cat.get_cont_str(resp) == {'gcmcontinue': 'p|1'}
+
+    get_cat.cont_strs.append(cont)
+    params = get_cat.prepare_params()
+    assert params['gcmcontinue'] == 'page|4e4f|123'
+    assert params['continue'] == 'gcmcontinue||'
+
+
+def test_tokenizer_callbacks():
+    class Word(object):
+        def __init__(self, text):
+            self.text = text
+
+        @classmethod
+        def from_text(cls, match, text):
+            return cls(text)
+
+    source = 'ab cd ef'
+    lexicons = [[(r'\w+', lambda m: m.group())],  # match only
+                [(r'\w+', lambda m, t: t)],  # (match, text), as before
+                [(r'\w+', lambda *a: a[1])],
+                [(r'\w+', Word.from_text)]]
+    for lexicon in lexicons:
+        tokens = Tokenizer(lexicon).tokenize(source)
+        assert [getattr(t, 'text', t) for t in tokens] == \
+            ['ab', ' ', 'cd', ' ', 'ef']
+
+
+def test_named_templates():
+    get_infobox = GetParsedTemplates(_SF_INFOBOX,
+                                     names=['infobox_Settlement'])
+    tmpls = get_infobox.process()
+    assert [t.name for t in tmpls] == ['Infobox settlement']
+    assert tmpls[0]['name'] == 'San Francisco'
+
+    # the same templates as a full parse, filtered by name
+    source = ('{{Flag|a}} {{Box|{{Flag|nested}}}} [[File:x.png|{{Flag|b}}]]'
+              ' <!-- {{Flag|c}} --> {| {{Flag|d}} |} {{ template:flag|e}}')
+    named = get_page_templates(source, names=['Flag'])
+    assert [t.args for t in named] == [['a'], ['e']]
+    assert [t.args for t in named] == \
+        [t.args for t in get_page_templates(source)
+         if t.name.lower().endswith('flag')]
+    assert not get_page_templates(_SF_INFOBOX, names=['flag'])  # nested
+
+    get_parsed = GetParsedTranscludes('Infobox_settlement')
+    assert get_parsed.subop_queues[-1].subop_kwargs == \
+        {'names': ['Infobox_settlement']}
+
+
+def test_parse_pool():
+    parse_pool = ParsePool(processes=1)
+    try:
+        tmpls = parse_pool.get_page_templates(_SF_INFOBOX,
+                                              names=['Infobox settlement'])
+    finally:
+        parse_pool.close()
+    assert [(t.name, t['name']) for t in tmpls] == \
+        [('Infobox settlement', 'San Francisco')]
+
+
+_TEST_DUMP = '''<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/">
+  <siteinfo>
+    <sitename>Wikipedia</sitename>
+    <base>https://en.wikipedia.org/wiki/Main_Page</base>
+  </siteinfo>
+  <page>
+    <title>Coffee</title>
+    <ns>0</ns>
+    <id>604727</id>
+    <revision>
+      <id>100</id>
+      <timestamp>2013-01-01T00:00:00Z</timestamp>
+      <contributor><username>Example</username><id>42</id></contributor>
+      <comment>first</comment>
+      <text bytes="26">{{flag|California}} beans</text>
+    </revision>
+    <revision>
+      <id>101</id>
+      <parentid>100</parentid>
+      <timestamp>2013-01-02T00:00:00Z</timestamp>
+      <contributor><ip>127.0.0.1</ip></contributor>
+      <text bytes="23">{{cite web|url=x}} café</text>
+    </revision>
+  </page>
+  <page>
+    <title>Talk:Coffee</title>
+    <ns>1</ns>
+    <id>604728</id>
+    <revision>
+      <id>200</id>
+      <timestamp>2013-01-03T00:00:00Z</timestamp>
+      <contributor deleted="deleted" />
+      <text bytes="11">{{talkpage}}</text>
+    </revision>
+  </page>
+</mediawiki>
+'''
+
+
+def test_dump_revisions(tmpdir):
+    import bz2
+    from dump import iter_dump_revisions, GetDumpRevisions
+    dump_str = _TEST_DUMP.encode('utf-8')
+    xml_path = str(tmpdir.join('pages.xml'))
+    with open(xml_path, 'wb') as f:
+        f.write(dump_str)
+    # a multistream bz2: the dump split across two bzip2 streams
+    bz2_path = str(tmpdir.join('pages.xml.bz2'))
+    with open(bz2_path, 'wb') as f:
+        f.write(bz2.compress(dump_str[:300]) + bz2.compress(dump_str[300:]))
+
+    revs = list(iter_dump_revisions(bz2_path))
+    assert [r.rev_id for r in revs] == [100, 101, 200]
+    assert revs[1].content == '{{cite web|url=x}} café'
+    assert revs[1].parent_rev_id == 100
+    assert revs[1].user_text == '127.0.0.1'
+    assert revs[2].user_text == '!userhidden'
+    assert revs[2].talk_id == 604728
+    assert revs[0].source == 'https://en.wikipedia.org/wiki/Main_Page'
+
+    get_revs = GetDumpRevisions(xml_path, namespaces=[0])
+    assert [r.rev_id for r in get_revs()] == [100, 101]
+
+
+def test_dump_parsed_templates(tmpdir):
+    from dump import GetDumpParsedTemplates
+    xml_path = str(tmpdir.join('pages.xml'))
+    with open(xml_path, 'wb') as f:
+        f.write(_TEST_DUMP.encode('utf-8'))
+    get_tmpls = GetDumpParsedTemplates(xml_path, namespaces=[0])
+    assert get_tmpls.subop_queues[1].peek().kwargs['namespaces'] == [0]
+    tmpl_names = sorted([t.name for t in get_tmpls.iter_results()])
+    assert tmpl_names == ['cite web', 'flag']
+
+
+def test_model_from_query():
+    from models import RevisionInfo, CategoryInfo
+    rev_dict = {'title': 'Talk:Coffee', 'ns': 1, 'pageid': 12, 'revid': 34,
+                'size': 56, 'timestamp': '2013-01-01T00:00:00Z', 'tags': []}
+    fast = RevisionInfo.from_query(rev_dict, source='enwp')
+    slow = RevisionInfo._init_from_query(rev_dict, {'source': 'enwp'})
+    attr_names = [a.name for a in RevisionInfo.attributes] + ['req_title']
+    assert ([getattr(fast, n) for n in attr_names]
+            == [getattr(slow, n) for n in attr_names])
+    assert fast.talk_id == 12 and fast.req_title == 'Talk:Coffee'
+
+    cat_info = CategoryInfo.from_query({'title': 'Category:Africa', 'ns': 14,
+                                        'size': '7'}, source='enwp')
+    assert cat_info.total_count == 7 and cat_info.subcat_count == 0
+    try:
+        RevisionInfo.from_query({'title': 'Coffee', 'ns': 0})
+    except ValueError as ve:
+        assert 'rev_id' in str(ve)
+    else:
+        assert False, 'expected ValueError for missing attributes'
+
+
+def test_model_slots():
+    from models import PageInfo, RevisionInfo
+    source = 'http://en.wikipedia.org/w/api.php'
+    talk_info = PageInfo.from_query({'title': 'Talk:Coffee', 'ns': 1,
+                                     'pageid': 12, 'subjectid': 34},
+                                    source=source)
+    other_info = PageInfo.from_query({'title': 'Tea', 'ns': 0},
+                                     source=''.join(source))
+    assert not hasattr(talk_info, '__dict__')
+    assert not hasattr(RevisionInfo.__new__(RevisionInfo), '__dict__')
+    assert talk_info.source is other_info.source  # interned
+
+    subj_info = talk_info.get_subject_info()
+    assert (subj_info.title, subj_info.ns) == ('Coffee', 0)
+    assert subj_info.get_talk_info().title == 'Talk:Coffee'
+
+
+def test_columnar_revisions():
+    import cPickle as pickle
+    from revisions import GetPageRevisionInfos
+    query_resp = {'pages': {'12': {'pageid': 12, 'ns': 0, 'title': 'Coffee',
+                                   'revisions': [
+                {'revid': 101, 'parentid': 100, 'user': 'Example',
+                 'userid': 42, 'size': 50, 'timestamp': '2013-01-01T00:00:00Z'},
+                {'revid': 102, 'parentid': 101, 'user': 'Example',
+                 'userid': 42, 'size': 70, 'timestamp': '2013-01-02T00:00:00Z'},
+                {'revid': 103, 'parentid': 102, 'userhidden': '',
+                 'size': 90, 'timestamp': '2013-01-03T00:00:00Z'}]}}}
+    get_revs = GetPageRevisionInfos('Coffee', 2, columnar=True)
+    table = get_revs.extract_table(query_resp)
+    assert len(table) == 3
+    assert list(table['rev_id']) == [101, 102, 103]
+    assert list(table['timestamp'])[0] == 1356998400
+    assert table['user_text'][0] is table['user_text'][1]
+    assert table['user_text'][2] == '!userhidden'
+
+    big_revs = table.filter('size', lambda size: size > 60)
+    assert list(big_revs['rev_id']) == [102, 103]
+    assert [row.title for row in big_revs] == ['Coffee', 'Coffee']
+
+    get_revs._update_results(table)  # the limit is 2
+    assert list(get_revs.results['rev_id']) == [101, 102]
+    restored = pickle.loads(pickle.dumps(get_revs.results, 2))
+    assert restored.to_dict() == get_revs.results.to_dict()
+
+    try:
+        GetCategory('Africa', columnar=True)
+    except ValueError:
+        pass
+    else:
+        assert False, 'expected ValueError for unsupported columnar op'
+
+
+def test_parse_timestamp():
+    from datetime import datetime
+    from models import (parse_timestamp, parse_timestamp_epoch,
+                        RevisionInfo, TIMESTAMP_FORMAT)
+    ts = '2013-02-21T21:54:25Z'
+    assert parse_timestamp(ts) == datetime.strptime(ts, TIMESTAMP_FORMAT)
+    assert parse_timestamp(ts) is parse_timestamp(ts)  # memoized
+    assert parse_timestamp_epoch(ts) == 1361483665
+    try:
+        parse_timestamp('2013-02-21 21:54:25')
+    except ValueError:
+        pass
+    else:
+        assert False, 'expected ValueError for malformed timestamp'
+
+    rev_dict = {'title': 'Coffee', 'ns': 0, 'revid': 1, 'size': 2,
+                'timestamp': ts, 'tags': []}
+    RevisionInfo.timestamp_mode = 'epoch'
+    try:
+        rev_info = RevisionInfo.from_query(rev_dict, source='enwp')
+    finally:
+        RevisionInfo.timestamp_mode = 'datetime'
+    assert rev_info.timestamp_epoch == 1361483665
+    assert rev_info.timestamp == parse_timestamp(ts)
+
+
+def test_siteinfo_cache(tmpdir):
+    from models import SourceInfo
+    from client import WapitiClient
+    api_url = 'http://example.com/w/api.php'
+    cache_dir = tmpdir.join('siteinfo')
+    cache = SiteInfoCache(str(cache_dir))
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        return SourceInfo(mainpage='Main Page')
+
+    assert cache.get(api_url) is None
+    assert not cache_dir.check()  # created on first write
+    assert cache.get_or_fetch(api_url, fetch).mainpage == 'Main Page'
+    assert cache.get_or_fetch('HTTP://EXAMPLE.COM/w/api.php',
+                              fetch).mainpage == 'Main Page'
+    assert len(fetches) == 1
+
+    # source_info is loaded lazily, here from the cache, not the network
+    client = WapitiClient('test@example.com', api_url=api_url,
+                          siteinfo_cache=cache)
+    assert client._source_info is None
+    assert client.source_info.mainpage == 'Main Page'
+    assert WapitiClient('test@example.com').siteinfo_cache is None  # opt-in
+    default_cache = WapitiClient('test@example.com',
+                                 siteinfo_cache=True).siteinfo_cache
+    assert default_cache.path.endswith(os.path.join('.cache', 'wapiti'))
+
+    expired_cache = SiteInfoCache(str(cache_dir), ttl=-1)
+    expired_cache.get_or_fetch(api_url, fetch)
+    assert len(fetches) == 2
+
+
+def test_operation_registry():
+    import operations
+    registered = dict([(op.__name__, op.__module__.rpartition('.')[2])
+                       for op in operations.ALL_OPERATIONS])
+    listed = dict([(op_name, mod_name) for mod_name, op_names
+                   in operations.OPERATION_MODULES.items()
+                   for op_name in op_names])
+    assert registered == listed
+
+
+def test_query_fusion():
+    fused_type = GetParsedTranscludes.fused_chain[0]
+    assert fused_type.generator_type is GetTranscludes
+    assert fused_type.prop_type is GetCurrentContent
+    assert fused_type not in base.OperationMeta._all_ops
+    chain = GetParsedTemplatesPage.subop_chain
+    assert GetParsedTemplatesPage.fused_chain == chain  # nothing to fuse
+    # info has no data of its own in pages to tell which were cut short
+    assert not base.is_fusable(GetTranscludes, GetPageInfo)
+
+    get_transcludes = GetParsedTranscludes('ArticleHistory', 10)
+    assert get_transcludes.subop_queues[1].op_type is fused_type
+    assert len(get_transcludes.subop_queues) == 3
+    unfused = GetParsedTranscludes('ArticleHistory', 10, fuse=False)
+    assert len(unfused.subop_queues) == 4
+
+    fused = fused_type('ArticleHistory')
+    assert fused.params['generator'] == 'embeddedin'
+    assert fused.params['prop'] == 'info|revisions'
+    assert 'content' in fused.params['rvprop']
+    assert fused.per_query_limit == 50  # as many titles as a prop query
+
+    rev = {'revid': 2, 'parentid': 1, 'user': 'Example', 'userid': 42,
+           'timestamp': '2013-02-21T21:54:25Z', 'size': 20, 'comment': '',
+           'tags': [], '*': '{{ArticleHistory}}'}
+    pages = {'1': {'pageid': 1, 'ns': 0, 'title': 'Coffee',
+                   'revisions': [rev]},
+             '3': {'pageid': 3, 'ns': 0, 'title': 'Tea'}}
+    fused._is_prop_cut_short = True  # as if the response was too large
+    revs = fused.extract_results({'pages': pages})
+    assert [(r.title, r.req_title) for r in revs] == [('Coffee', 'Coffee')]
+    assert fused._fallback_titles == ['Tea']
+    fused.cont_strs.append(None)  # the generator is done, Tea isn't
+    assert fused.remaining
+
+    fused = fused_type('ArticleHistory')
+    resp = make_call(fused.prepare_params(),
+                     {'query': {'pages': pages},
+                      'continue': {'rvcontinue': '3', 'continue': '||'}})
+    revs = fused.store_results(resp, resp)
+    assert [r.title for r in revs] == ['Coffee']
+    assert not fused._fallback_titles  # Tea's revision comes next
+    assert fused.last_cont_str['rvcontinue'] == '3'
+    assert fused.per_query_limit > 50
+
+    pages = dict([(str(i), {'pageid': i, 'ns': 0, 'title': 'Page %d' % i,
+                            'revisions': [dict(rev, revid=i)]})
+                  for i in range(120)])
+    revs = fused.extract_results({'pages': pages})
+    assert sorted([r.req_title for r in revs]) == \
+        sorted([p['title'] for p in pages.values()])
+
+
+def test_batch_query():
+    op_types = [GetPageInfo, GetProtections, GetCoordinates, GetLanguageLinks]
+    assert all([is_batchable(op_type) for op_type in op_types])
+    assert not is_batchable(GetTranscludes)  # a generator
+    assert not is_batchable(GetParsedTemplates)
+    try:
+        BatchQuery(['Coffee'], op_types=[GetPageInfo, GetTranscludes])
+    except ValueError:
+        pass
+    else:
+        assert False, 'expected ValueError for a generator operation'
+
+    titles = ['Page %d' % i for i in range(120)] + ['Page 0']
+    get_batch = BatchQuery(titles, op_types=op_types)
+    assert [len(chunk) for chunk in get_batch._chunks] == [50, 50, 20]
+
+    params = {}
+    for op_type in op_types:
+        op = op_type(['Coffee', 'Tea'])
+        params = base.merge_query_params(params, op.prepare_params())
+    assert params['prop'] == 'info|coordinates|langlinks'
+    assert params['inprop'] == 'subjectid|talkid|protection'
+    assert params['titles'] == 'Coffee|Tea'
+
+
+
+def test_batch_query_continuation():
+    client = make_stub_client()
+    api = client.web_client
+    op_types = [GetPageInfo, GetLanguageLinks]
+
+    def page(pid, title, langs=None):
+        ret = {'pageid': pid, 'ns': 0, 'title': title}
+        if langs:
+            ret['langlinks'] = [{'lang': lang, '*': title} for lang in langs]
+        return ret
+
+    first_pages = {'1': dict(page(1, 'Coffee', ['de', 'fr']), talkid=11),
+                   '2': dict(page(2, 'Tea'), talkid=12)}
+    next_pages = {'1': page(1, 'Coffee', ['it']),
+                  '2': page(2, 'Tea', ['es'])}
+    query_params = {}
+    for op_type in op_types:
+        op = op_type(['Coffee', 'Tea'], client=client)
+        query_params = base.merge_query_params(query_params,
+                                               op.prepare_params())
+    ll_params = GetLanguageLinks(['Coffee', 'Tea'],
+                                 client=client).prepare_params()
+
+    # unified continue: the whole query again, only langlinks read it
+    unified_cont = {'llcontinue': '1|it', 'continue': '||info'}
+    api.add(query_params, {'query': {'pages': first_pages},
+                           'continue': unified_cont})
+    api.add(dict(query_params, **unified_cont),
+            {'query': {'pages': next_pages}, 'batchcomplete': ''})
+    # legacy query-continue: langlinks queried alone
+    legacy_params = dict(query_params, titles='Coffee|Tea|Milk')
+    api.add(legacy_params,
+            {'query': {'pages': first_pages},
+             'query-continue': {'langlinks': {'llcontinue': '1|it'}}})
+    api.add(dict(ll_params, titles='Coffee|Tea|Milk', llcontinue='1|it'),
+            {'query': {'pages': next_pages}})
+
+    for titles in (['Coffee', 'Tea'], ['Coffee', 'Tea', 'Milk']):
+        get_batch = BatchQuery(titles, op_types=op_types, client=client)
+        results = get_batch.process_all()
+        assert len(results) == 6
+        langs = [ll.language for ll in get_batch.get_results(GetLanguageLinks)]
+        assert sorted(langs) == ['de', 'es', 'fr', 'it']
+        infos = get_batch.get_results(GetPageInfo)
+        assert sorted([pi.talk_id for pi in infos]) == [11, 12]
+    assert len(api.requests) == 4
+    get_batch = BatchQuery(['Coffee', 'Tea'], op_types=op_types,
+                           client=client)
+    assert len(list(get_batch.iter_results())) == 6
+    try:
+        get_batch.get_results(GetLanguageLinks)
+    except ValueError:
+        pass
+    else:
+        assert False, 'expected ValueError once streaming'
+    assert 'inprop' not in api.requests[3]  # langlinks queried alone
+
+
+def test_coordinates_extract():
+    pages = {'1': {'pageid': 1, 'ns': 0, 'title': 'Coffee'},
+             '2': {'pageid': 2, 'ns': 0, 'title': 'Tea',
+                   'coordinates': [{'lat': 1.0, 'lon': 2.0, 'primary': ''},
+                                   {'lat': 3.0, 'lon': 4.0}]}}
+    get_coords = GetCoordinates(['Coffee', 'Tea'])
+    coords = get_coords.extract_results({'pages': pages})
+    assert sorted([(c.lat, c.primary) for c in coords]) == [(1.0, True),
+                                                            (3.0, False)]
+
+
+def test_multiplexed_chunks(tmpdir):
+    client = make_stub_client()
+    api = client.web_client
+    titles = ['Page %d' % i for i in range(120)]
+    for chunk in chunked_iter(titles, 50):
+        pages = dict([(str(i), {'pageid': i, 'ns': 0, 'title': t})
+                      for i, t in enumerate(chunk)])
+        resp = {'query': {'pages': pages}, 'batchcomplete': ''}
+        api.add(GetPageInfo(chunk).prepare_params(), resp)
+
+    get_info = GetPageInfo(titles, client=client)
+    assert get_info.is_multiplexing
+    first = get_info.process()  # the second chunk is sent meanwhile
+    assert set([p.title for p in first]) == set(titles[:50])
+    assert len(get_info._mux_inflight) == 1
+    assert len(get_info.subop_queues[0]) == 1
+
+    path = str(tmpdir.join('checkpoint.gz'))
+    get_info.checkpoint(path)
+    resumed = GetPageInfo.resume(path, client=client)
+    assert len(resumed.subop_queues[0]) == 2  # the in-flight chunk too
+    second = resumed.process()
+    assert set([p.title for p in second]) == set(titles[50:100])
+    results = resumed.process_all()
+    assert sorted([p.title for p in results]) == sorted(titles)
+    assert len(api.requests) == 4  # the in-flight chunk was resent
+
+
+def test_prefetch_continuation():
+    client = make_stub_client()
+    api = client.web_client
+
+    def add_pages(get_cat, count):
+        params = get_cat.prepare_params()
+        for i in range(count):
+            pages = {str(i): {'pageid': i, 'ns': 0, 'title': 'Page %d' % i}}
+            resp = {'query': {'pages': pages}}
+            next_cont = {'gcmcontinue': 'page|%d' % (i + 1),
+                         'continue': 'gcmcontinue||'}
+            if i < count - 1:
+                resp['continue'] = next_cont
+            api.add(params, resp)
+            params = dict(params, **next_cont)
+
+    get_cat = GetCategory('Test', client=client)
+    add_pages(get_cat, 3)
+    assert [p.title for p in get_cat.process()] == ['Page 0']
+    assert get_cat._prefetched is not None  # page 2 is already requested
+    results = get_cat.process_all()
+    assert [p.title for p in results] == ['Page 0', 'Page 1', 'Page 2']
+    assert get_cat._prefetched is None
+    assert len(api.requests) == 3
+
+    get_cat = GetCategory('Test', 1, client=client)
+    add_pages(get_cat, 2)
+    get_cat.process()
+    assert get_cat._prefetched is None  # the limit is already reached
+
+    # a module can finish before the others, e.g., revisions of a
+    # generator's pages, and its continuation must not be resent
+    get_cat = GetCategory('Test', client=client)
+    first_params = get_cat.prepare_params()
+    params = first_params
+    conts = [{'rvcontinue': '5', 'gcmcontinue': 'A',
+              'continue': 'gcmcontinue||'},
+             {'gcmcontinue': 'B', 'continue': 'gcmcontinue||'},
+             None]
+    for i, cont in enumerate(conts):
+        pages = {str(i): {'pageid': i, 'ns': 0, 'title': 'Page %d' % i}}
+        resp = {'query': {'pages': pages}}
+        if cont:
+            resp['continue'] = cont
+        api.add(params, resp)
+        params = dict(first_params, **(cont or {}))
+    get_cat.process()
+    get_cat.process()
+    prefetched_call = get_cat._prefetched[0]
+    assert prefetched_call.params['gcmcontinue'] == 'B'
+    assert 'rvcontinue' not in prefetched_call.params
+    results = get_cat.process_all()
+    assert [p.title for p in results] == ['Page 0', 'Page 1', 'Page 2']
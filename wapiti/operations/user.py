@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 from base import QueryOperation
 from params import SingleParam, StaticParam
 from models import RevisionInfo
+from table import RevisionTable
 from utils import OperationExample
 
 
@@ -16,8 +17,13 @@ class GetUserContribs(QueryOperation):
     fields = [StaticParam('list', 'usercontribs'),
               StaticParam('ucprop', DEFAULT_PROPS)]
     output_type = [RevisionInfo]
+    table_type = RevisionTable
     examples = [OperationExample('Jimbo Wales')]
 
+    def iter_result_dicts(self, query_resp):
+        for rev_dict in query_resp.get('usercontribs', []):
+            yield rev_dict, None
+
     def extract_results(self, query_resp):
         ret = []
         for rev_dict in query_resp.get('usercontribs', []):
@@ -257,6 +257,8 @@ class PriorityQueue(object):
     def remove(self, task):
         entry = self._entry_map.pop(task)
         entry[-1] = REMOVED
+        while self._pq and self._pq[0][-1] is REMOVED:
+            heappop(self._pq)  # deeper ones are culled as they surface
 
     def _cull(self):
         while self._pq:
@@ -277,6 +279,31 @@ class PriorityQueue(object):
             raise IndexError('peek on empty queue')
         return task
 
+    def peek_many(self, count):
+        """
+        Returns up to ``count`` of the highest-priority tasks, in
+        priority order, without removing them.
+        """
+        # pop and push back, rather than scan the whole heap, culling
+        # removed tasks along the way
+        entries = []
+        while len(entries) < count:
+            try:
+                self._cull()
+            except IndexError:
+                break
+            entries.append(heappop(self._pq))
+        for entry in entries:
+            heappush(self._pq, entry)
+        return [task for _, _, task in entries]
+
+    def items(self):
+        """
+        Returns (task, priority) pairs for all tasks, in priority order.
+        """
+        entries = sorted([e for e in self._pq if e[-1] is not REMOVED])
+        return [(task, -priority) for priority, _, task in entries]
+
     def pop(self, default=REMOVED):
         try:
             self._cull()
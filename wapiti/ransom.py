@@ -6,15 +6,28 @@ This is like a mini version of requests, which has simply
 grown too heavy and presented multiple compatibility issues
 re: api changes and gevent.
 """
-import urllib2
+import time
 import gzip
+import socket
+import httplib
+import urllib2
+import threading
+from collections import deque
 
 from compat import (unicode, bytes, OrderedDict, StringIO,
-                    urlparse, urlunparse, urlencode, requote)
+                    urlparse, urlunparse, urljoin, urlencode, requote)
 
 
 DEFAULT_CONFIG = {
-    'headers': {'User-Agent': 'reqs/0.0.0'}}
+    'headers': {'User-Agent': 'reqs/0.0.0'},
+    'pool_size': 4,           # idle connections kept per host
+    'pool_idle_timeout': 30,  # seconds before an idle connection is dropped
+    'pool_reconnects': 2,     # retries when a reused connection was reset
+    'max_redirects': 5,
+    'timeout': None}          # None = socket default timeout
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+THROTTLE_CODES = (429, 502, 503, 504)
 
 
 class Response(object):
@@ -27,6 +40,11 @@ class Response(object):
         self.text = text
         self.headers = headers
         self.error = error
+        self.elapsed = None  # seconds, including redirects
+        self.raw_size = 0    # body size as sent, e.g., gzipped
+        self.size = 0        # body size after decompression
+        self.retries = 0     # resent after a connection reset
+        self.retry_after = None  # seconds, from the Retry-After header
 
 
 def get_items(iterable):
@@ -88,13 +106,15 @@ def parse_url(url):
 
 def encode_url_params(params, keep_blank=False):
     # TODO: handle case where params is just a string
+    # keep_blank is either a bool, or the names of params to keep blank
     res = []
     for k, vs in get_items(params):
         if is_scalar(vs):
             vs = [vs]
         for v in vs:
             if not v:
-                if keep_blank:
+                if keep_blank is True or \
+                        (keep_blank and k in keep_blank):
                     v = ''
                 else:
                     continue
@@ -114,11 +134,11 @@ def encode_url_params(params, keep_blank=False):
 """
 
 
-def construct_url(url, params):
+def construct_url(url, params, keep_blank=False):
     parsed_url = parse_url(url)
 
     query = parsed_url.query
-    encoded_params = encode_url_params(params)
+    encoded_params = encode_url_params(params, keep_blank)
     if encoded_params:
         if query:
             query = query + '&' + encoded_params
@@ -129,19 +149,198 @@ def construct_url(url, params):
     return new_url
 
 
+def parse_retry_after(value):
+    """
+    Returns the number of seconds to wait according to a Retry-After
+    header value (either seconds or an HTTP date), or None.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    from email.utils import parsedate_tz, mktime_tz  # rarely needed
+    date_tuple = parsedate_tz(value)
+    if date_tuple is None:
+        return None
+    return max(0, mktime_tz(date_tuple) - time.time())
+
+
 def gunzip(text):
     buf = StringIO(text)
     f = gzip.GzipFile(fileobj=buf)
     return f.read()
 
 
+class ConnectionPool(object):
+    """
+    Keeps up to ``size`` idle persistent (HTTP/1.1) connections per
+    host, so that consecutive requests to the same API skip the TCP
+    (and TLS) handshake. Connections that sat idle for longer than
+    ``idle_timeout`` seconds are closed rather than reused, as the
+    server has most likely hung up on them already.
+
+    The pool never blocks: if no idle connection is available, a new
+    one is opened, and connections returned to a full pool are
+    closed. Safe for use from multiple threads (or greenlets).
+    """
+    def __init__(self, size=4, idle_timeout=30, timeout=None):
+        self.size = int(size)
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme, netloc):
+        """
+        Returns a tuple of (connection, is_reused).
+        """
+        key = (scheme, netloc)
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    return conn, True
+                conn.close()
+        return self._connect(scheme, netloc), False
+
+    def put(self, scheme, netloc, conn):
+        key = (scheme, netloc)
+        with self._lock:
+            idle = self._idle.setdefault(key, deque())
+            if len(idle) < self.size:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle_lists, self._idle = self._idle.values(), {}
+        for idle in idle_lists:
+            for conn, _ in idle:
+                conn.close()
+
+    def _connect(self, scheme, netloc):
+        if scheme == 'https':
+            conn_type = httplib.HTTPSConnection
+        elif scheme == 'http':
+            conn_type = httplib.HTTPConnection
+        else:
+            raise ValueError('unsupported URL scheme: %r' % scheme)
+        if self.timeout is None:
+            return conn_type(netloc)
+        return conn_type(netloc, timeout=self.timeout)
+
+    def __len__(self):
+        with self._lock:
+            return sum([len(idle) for idle in self._idle.values()])
+
+
+class RateLimiter(object):
+    """
+    A token bucket which lets ``rate`` requests per second through on
+    average, in bursts of up to ``burst`` requests, shared by all the
+    threads (or greenlets) making requests. ``acquire()`` before each
+    request, and ``record()`` how it went afterward.
+
+    The rate adapts, AIMD-style: every timely, successful request
+    raises it by ``increase`` (up to ``max_rate``), while throttling
+    statuses (429, 503, etc.), timeouts, and requests much slower
+    than the running average latency multiply it by ``decrease``
+    (down to ``min_rate``). Decreases are at most once a second, so
+    that a batch of concurrent requests hitting the same slowdown
+    only counts once. ``backoff()`` additionally holds back all
+    requests for a while, e.g., as requested by a Retry-After header.
+    """
+    def __init__(self, rate=5.0, burst=5, min_rate=0.5, max_rate=25.0,
+                 increase=0.25, decrease=0.5, slow_factor=3.0,
+                 min_slow_latency=1.0, max_backoff=300):
+        self.rate = float(rate)
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.slow_factor = slow_factor
+        self.min_slow_latency = min_slow_latency
+        self.max_backoff = max_backoff
+        self.avg_latency = None
+
+        self._tokens = float(burst)
+        self._last_fill = time.time()
+        self._blocked_until = 0
+        self._last_decrease = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, sleeping until one is available (or until the
+        current backoff is over). Returns the number of seconds slept.
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens
+                               + (now - self._last_fill) * self.rate)
+            self._last_fill = now
+            self._tokens -= 1
+            wait = max(0, self._blocked_until - now)
+            if self._tokens < 0:
+                wait = max(wait, -self._tokens / self.rate)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def record(self, elapsed, status_code=200):
+        with self._lock:
+            if status_code in THROTTLE_CODES:
+                self._slow_down()
+                return
+            avg_latency = self.avg_latency
+            if avg_latency is None:
+                avg_latency = elapsed
+            self.avg_latency = 0.8 * avg_latency + 0.2 * elapsed
+            if elapsed > max(self.min_slow_latency,
+                             self.slow_factor * avg_latency):
+                self._slow_down()
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def throttle(self):
+        with self._lock:
+            self._slow_down()
+
+    def backoff(self, seconds):
+        seconds = min(seconds, self.max_backoff)
+        with self._lock:
+            self._blocked_until = max(self._blocked_until,
+                                      time.time() + seconds)
+            self._slow_down()
+
+    def _slow_down(self):
+        now = time.time()
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+
+    def __repr__(self):
+        return '<%s rate=%.2f/s>' % (self.__class__.__name__, self.rate)
+
+
 class Client(object):
-    def __init__(self, config=None):  # among other things
+    def __init__(self, config=None, rate_limiter=None):  # among other things
         self.config = dict(DEFAULT_CONFIG)
         if config:
             self.config.update(config)
+        self.rate_limiter = rate_limiter
+        self.pool = ConnectionPool(size=self.config['pool_size'],
+                                   idle_timeout=self.config['pool_idle_timeout'],
+                                   timeout=self.config['timeout'])
 
-    def req(self, method, url, params=None, headers=None, use_gzip=True):
+    def req(self, method, url, params=None, headers=None, use_gzip=True,
+            keep_blank=False):
         _headers = dict(self.config.get('headers', {}))
         if headers:
             _headers.update(headers)
@@ -149,33 +348,102 @@ class Client(object):
         if use_gzip and not headers.get('Accept-encoding'):
             headers['Accept-encoding'] = 'gzip'
 
-        full_url = construct_url(url, params)
+        full_url = construct_url(url, params, keep_blank)
         ret = Response()
         ret.url = full_url
-        resp_text = None
-        resp_status = None
-        resp_headers = {}
+        start_time = time.time()
+        for _ in range(self.config['max_redirects'] + 1):
+            resp, resp_text, retries = self._limited_send(method, ret.url,
+                                                          headers)
+            ret.retries += retries
+            location = resp.getheader('location')
+            if resp.status not in REDIRECT_CODES or not location:
+                break
+            ret.url = urljoin(ret.url, location)
+            if resp.status == 303:
+                method = 'get'
+        else:
+            raise urllib2.HTTPError(ret.url, resp.status,
+                                    'too many redirects', resp.msg, None)
+        if resp.status >= 400:
+            raise urllib2.HTTPError(ret.url, resp.status, resp.reason,
+                                    resp.msg, None)
+        ret.raw_size = len(resp_text)
+        if 'gzip' in resp.getheader('content-encoding', ''):
+            resp_text = gunzip(resp_text)
+        ret.elapsed = time.time() - start_time
+        ret.size = len(resp_text)
+        ret.retry_after = parse_retry_after(resp.getheader('retry-after'))
+        ret.text = resp_text
+        ret.status_code = resp.status
+        ret.headers = resp.msg
+        return ret
+
+    def _limited_send(self, method, url, headers):
+        limiter = self.rate_limiter
+        if limiter is None:
+            return self._send(method, url, headers)
+        limiter.acquire()
+        start_time = time.time()
         try:
-            req = urllib2.Request(full_url, headers=headers)
-            resp = urllib2.urlopen(req)
-            resp_text = resp.read()
-            resp.close()
-            if 'gzip' in resp.info().get('Content-Encoding', ''):  # TODO
-                resp_text = gunzip(resp_text)
-            resp_status = resp.getcode()
-            resp_headers = resp.headers
-        except Exception as e:
+            ret = self._send(method, url, headers)
+        except (socket.error, httplib.HTTPException):
+            limiter.throttle()
             raise
-        ret.text = resp_text
-        ret.status_code = resp_status
-        ret.headers = resp_headers
+        resp = ret[0]
+        retry_after = parse_retry_after(resp.getheader('retry-after'))
+        if retry_after is not None:
+            limiter.backoff(retry_after)
+        else:
+            limiter.record(time.time() - start_time, resp.status)
         return ret
 
-    def get(self, url, params=None, headers=None, use_gzip=True):
-        return self.req('get', url, params, headers, use_gzip)
+    def _send(self, method, url, headers):
+        """
+        Sends a single request over a pooled connection and reads the
+        whole body, so the connection can go back into the pool. If a
+        reused connection turns out to have been reset by the server,
+        the request is transparently retried on a fresh connection.
+
+        Returns a tuple of (response, body, number of retries).
+        """
+        parsed = urlparse(url)
+        scheme, netloc = parsed.scheme, parsed.netloc
+        path = urlunparse(('', '', parsed.path or '/', parsed.params,
+                           parsed.query, ''))
+        reconnects = retries = self.config['pool_reconnects']
+        while True:
+            conn, is_reused = self.pool.get(scheme, netloc)
+            try:
+                conn.request(method.upper(), path, headers=headers)
+                resp = conn.getresponse()
+                resp_text = resp.read()
+            except socket.timeout:
+                conn.close()
+                raise
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                if is_reused and reconnects > 0:
+                    reconnects -= 1
+                    continue
+                raise
+            break
+        if resp.will_close:
+            conn.close()
+        else:
+            self.pool.put(scheme, netloc, conn)
+        return resp, resp_text, retries - reconnects
+
+    def close(self):
+        self.pool.clear()
+
+    def get(self, url, params=None, headers=None, use_gzip=True,
+            keep_blank=False):
+        return self.req('get', url, params, headers, use_gzip, keep_blank)
 
-    def post(self, url, params=None, headers=None, use_gzip=True):
-        return self.req('post', url, params, headers, use_gzip)
+    def post(self, url, params=None, headers=None, use_gzip=True,
+             keep_blank=False):
+        return self.req('post', url, params, headers, use_gzip, keep_blank)
 
 
 # lol compat